@@ -0,0 +1,90 @@
+#!/bin/python3
+
+# Benchmark of the calendar pages on a year of dense data: the per-day
+# bucketing of a month's rows compared with the old scan of all rows for
+# every day, and the year view from one grouped query compared with one query
+# per day. Run from anywhere:
+#
+#   python bench/bench_calendar.py [entries per day]
+
+import sys, time
+from datetime import date, timedelta
+import benchutil
+from benchutil import timelog
+
+
+# Old calendar loop: for each day, look through all of the month's rows
+def scanDays(ww, ndays):
+    n = 0
+    for day in range(1, ndays + 1):
+        projHrs = {}
+        billable = {}
+        for w in ww:
+            d, pid, pname, hrs, b = w
+            d = int(d)
+            pid = int(pid)
+            if d == day:
+                projHrs[pid] = hrs
+                if b:
+                    billable[pid] = True
+        n += len(projHrs)
+    return n
+
+
+# New calendar loop: put the rows into a bucket per day first
+def bucketDays(ww, ndays):
+    dayHrs = {}
+    dayBillable = {}
+    for w in ww:
+        day, pid, pname, hrs, billable = w
+        day = int(day)
+        pid = int(pid)
+        dayHrs.setdefault(day, {})[pid] = hrs
+        if billable:
+            dayBillable.setdefault(day, {})[pid] = True
+    n = 0
+    for day in range(1, ndays + 1):
+        n += len(dayHrs.get(day, {}))
+    return n
+
+
+# Time a function, best of a few runs, in milliseconds
+def best(f, *args, runs = 5):
+    tt = []
+    for i in range(runs):
+        t = time.perf_counter()
+        f(*args)
+        tt.append(time.perf_counter() - t)
+    return min(tt) * 1000.0
+
+
+if __name__ == '__main__':
+
+    perDay = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    n = benchutil.makeDB(perDay = perDay)
+    print('%d entries in 2017, %d per day' % (n, perDay))
+
+    # Month rows as returned by the calendar query, without grouping so that
+    # there are as many as entries
+    db = timelog.sql.connect(benchutil.dbname)
+    ww = db.execute("select substr(work_date,9,2), project_id, '', hours, billable from work"
+            " where work_date >= '2017-03-01' and work_date < '2017-04-01'").fetchall()
+    assert scanDays(ww, 31) == bucketDays(ww, 31)
+    print('March, %d rows:' % len(ww))
+    print('  scan all rows per day  %8.2f ms' % best(scanDays, ww, 31))
+    print('  bucket rows by day     %8.2f ms' % best(bucketDays, ww, 31))
+
+    # Year view from one query, compared with a query for each day
+    def perDayQueries():
+        d = date(2017, 1, 1)
+        while d.year == 2017:
+            db.execute('select sum(hours) from work where work_date = ?', (d.isoformat(),)).fetchall()
+            d += timedelta(1)
+    def groupedQuery():
+        db.execute("select period, sum(hours) from work_daily where period >= '2017-01-01'"
+                " and period < '2018-01-01' group by period").fetchall()
+    print('Year 2017:')
+    print('  365 per-day queries    %8.2f ms' % best(perDayQueries))
+    print('  one grouped query      %8.2f ms' % best(groupedQuery))
+    print('  /calendar/year/2017    %8.2f ms' % best(benchutil.get, '/calendar/year/2017'))
+    print('  /calendar (March)      %8.2f ms' % best(benchutil.get, '/calendar?month=3&year=2017'))
@@ -0,0 +1,49 @@
+#!/bin/python3
+
+# Benchmark of the contact pages as the address book grows: the contact list
+# (first page) and the project contacts picker, compared with reading the
+# whole contact table as they used to, and the typeahead for random
+# prefixes of names. Run from anywhere:
+#
+#   python bench/bench_contacts.py [max contacts]
+
+import sys, time, random
+import benchutil
+from benchutil import timelog
+
+
+# Milliseconds per call of f()
+def measure(f, n = 50):
+    t = time.perf_counter()
+    for i in range(n):
+        f()
+    return (time.perf_counter() - t) / n * 1000.0
+
+
+# Everything in the contact table, as the contact pages used to read it
+def wholeTable():
+    db = timelog.sql.connect(benchutil.dbname)
+    db.execute('select id, last_name, first_name, company, title, phones, address, active '
+        'from contact order by last_name').fetchall()
+    db.close()
+
+
+if __name__ == '__main__':
+
+    maxContacts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(4)
+    ncontacts = 1000
+    root = timelog.os.path.dirname(benchutil.dbname)
+    while ncontacts <= maxContacts:
+        benchutil.dbname = timelog.os.path.join(root, 'contacts%d.db' % ncontacts)
+        benchutil.makeDB(days = 30, ncontacts = ncontacts)
+        timelog.create_app({'dbname': benchutil.dbname})
+        prefixes = ['Last%02d' % random.randint(0, 99) for i in range(200)]
+        print('%d contacts' % ncontacts)
+        for title, f in [
+                ('whole table (before)', wholeTable),
+                ('/contacts', lambda: benchutil.get('/contacts')),
+                ('/project_contacts/1', lambda: benchutil.get('/project_contacts/1')),
+                ('/contacts.json?q=...', lambda: benchutil.get('/contacts.json?q=%s' % random.choice(prefixes)))]:
+            print('  %-24s %8.2f ms' % (title, measure(f)))
+        ncontacts *= 10
@@ -0,0 +1,67 @@
+#!/bin/python3
+
+# Benchmark of the streaming export of work entries: time and peak memory
+# (Python allocations, measured with tracemalloc) of /export/work.csv and
+# /export/work.json read a chunk at a time, compared with building the same
+# CSV from fetchall() in memory, for a bigger and bigger work table. With
+# streaming, the peak should stay the same however many rows there are.
+# Run from anywhere:
+#
+#   python bench/bench_export.py [max rows]
+
+import os, sys, io, csv, time, tracemalloc
+import benchutil
+from benchutil import timelog
+
+
+# Read a response a chunk at a time, return bytes, seconds and peak memory
+def streamed(path, headers = {}):
+    tracemalloc.start()
+    t = time.perf_counter()
+    status, hdrs, chunks = benchutil.stream(path, headers)
+    n = 0
+    for c in chunks:
+        n += len(c)
+    chunks.close()
+    t = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return n, t, peak
+
+
+# The same CSV, all in memory at once
+def inMemory():
+    tracemalloc.start()
+    t = time.perf_counter()
+    db = timelog.sql.connect(benchutil.dbname)
+    rows = timelog.query(db.cursor(), 'export_work', '0001-01-01', '9999-12-31').fetchall()
+    s = io.StringIO()
+    w = csv.writer(s)
+    w.writerow(timelog.exportColumns['work'])
+    w.writerows(rows)
+    n = len(s.getvalue().encode('utf8'))
+    db.close()
+    t = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return n, t, peak
+
+
+if __name__ == '__main__':
+
+    maxRows = int(sys.argv[1]) if len(sys.argv) > 1 else 400000
+    perDay = 100
+    nrows = 25000
+    while nrows <= maxRows:
+        n = benchutil.makeDB(days = nrows // perDay, perDay = perDay)
+        print('%d entries' % n)
+        for title, (size, t, peak) in [
+                ('all in memory', inMemory()),
+                ('/export/work.csv', streamed('/export/work.csv')),
+                ('/export/work.json', streamed('/export/work.json')),
+                ('/export/work.csv gzip', streamed('/export/work.csv', {'Accept-Encoding': 'gzip'}))]:
+            print('  %-22s %8.1f MB %8.0f rows/sec  peak %7.1f MB' % (title, size / 1e6, n / t, peak / 1e6))
+        nrows *= 4
+        for ext in ['', '-wal', '-shm']:
+            if os.path.exists(benchutil.dbname + ext):
+                os.remove(benchutil.dbname + ext)
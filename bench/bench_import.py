@@ -0,0 +1,56 @@
+#!/bin/python3
+
+# Benchmark of importing work entries: one at a time the way save_log()
+# saves them (a max(id) query, an insert and a commit for each), compared
+# with importWork(), which checks all the rows, then inserts them with
+# executemany() in one transaction. Run from anywhere:
+#
+#   python bench/bench_import.py [rows]
+
+import sys, time, random
+from datetime import date, timedelta
+import benchutil
+from benchutil import timelog
+from queries import query
+
+
+# Generated rows to import, by client and project name
+def makeRows(n, nproj):
+    random.seed(2)
+    return [{'date': (date(2019, 1, 1) + timedelta(i // 20)).isoformat(),
+            'client': 'client %d' % (p % 10), 'project': 'project %d' % p,
+            'hours': random.choice(['0.25', '0.5', '1', '2']), 'billable': '',
+            'description': 'Imported item %d' % i}
+        for i, p in ((i, random.randint(1, nproj)) for i in range(n))]
+
+
+# Save the rows one by one, return seconds
+def oneByOne(db, rows):
+    t = time.perf_counter()
+    cur = db.cursor()
+    names = {}
+    for pid, client, name, billable in query(cur, 'project_names').fetchall():
+        names[(client.lower(), name.lower())] = pid
+    for r in rows:
+        pid = names[(r['client'], r['project'])]
+        wid = timelog.nextId('work', cur)
+        query(cur, 'insert_work', wid, pid, r['date'], float(r['hours']), 0, r['description'])
+        db.commit()
+    return time.perf_counter() - t
+
+
+if __name__ == '__main__':
+
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    nproj = 50
+    n = benchutil.makeDB(days = 365, perDay = 20, nproj = nproj)
+    rows = makeRows(nrows, nproj)
+    print('%d entries, importing %d more' % (n, nrows))
+    db = timelog.sql.connect(benchutil.dbname)
+    timelog.applyProfile(db)
+
+    t = oneByOne(db, rows)
+    print('  one at a time       %8.0f rows/sec' % (nrows / t))
+    report = timelog.importWork(db, rows)
+    print('  importWork()        %8.0f rows/sec, %d imported, %d rejected' % (report['rows_per_sec'],
+        report['imported'], report['rejected']))
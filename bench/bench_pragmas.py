@@ -0,0 +1,90 @@
+#!/bin/python3
+
+# Benchmark of concurrent reads and writes with and without the SQLite
+# performance profile (WAL, mmap, etc.). Reader threads run the monthly
+# report query while writer threads insert log entries like save_log, for a
+# few seconds each way. Run from the project directory:
+#
+#   python bench/bench_pragmas.py [readers] [writers] [seconds]
+
+import os, sys, time, random, tempfile, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import timelog
+
+
+# Create a database with a year of entries, return its name
+def makeDB(fname, nrows = 20000):
+    timelog.migrate(fname, verbose = False)
+    db = timelog.sql.connect(fname)
+    for i in range(1, 51):
+        db.execute("insert into project values (?, 'Client', ?, '', 1, 1, 0, 0)", (i, 'Project %d' % i))
+    rows = [(i, random.randint(1, 50), '2017-%02d-%02d' % (random.randint(1, 12), random.randint(1, 28)),
+        random.choice([0.5, 1.0, 2.0]), random.randint(0, 1), 'Entry %d' % i) for i in range(1, nrows + 1)]
+    db.executemany('insert into work values (?, ?, ?, ?, ?, ?)', rows)
+    db.commit()
+    db.close()
+
+
+# Run readers and writers against the database, return counts
+def run(fname, nreaders, nwriters, seconds):
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.time() + seconds
+    pool = timelog.ConnectionPool(fname, nreaders + nwriters)
+
+    def reader():
+        db = pool.acquire()
+        while time.time() < stop:
+            try:
+                m = random.randint(1, 12)
+                db.execute("select project_id, sum(hours) from work where work_date >= ? and work_date < ? group by project_id",
+                        ('2017-%02d-01' % m, '2017-%02d-32' % m)).fetchall()
+                n = 'reads'
+            except timelog.sql.OperationalError:
+                n = 'errors'
+            with lock:
+                counts[n] += 1
+        pool.release()
+
+    def writer():
+        db = pool.acquire()
+        while time.time() < stop:
+            try:
+                db.execute("insert into work values ((select max(id) + 1 from work), ?, '2017-06-15', 1.0, 1, 'bench')",
+                        (random.randint(1, 50),))
+                db.commit()
+                n = 'writes'
+            except timelog.sql.OperationalError:
+                db.rollback()
+                n = 'errors'
+            with lock:
+                counts[n] += 1
+        pool.release()
+
+    threads = [threading.Thread(target = reader) for i in range(nreaders)]
+    threads += [threading.Thread(target = writer) for i in range(nwriters)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    pool.close()
+    return counts
+
+
+if __name__ == '__main__':
+
+    nreaders = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    nwriters = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+
+    tmpdir = tempfile.mkdtemp()
+    print('%d readers, %d writers, %.0f seconds each' % (nreaders, nwriters, seconds))
+    for profile in ['default', 'performance']:
+        timelog.config['db_profile'] = profile
+        fname = os.path.join(tmpdir, profile + '.db')
+        makeDB(fname)
+        c = run(fname, nreaders, nwriters, seconds)
+        print('%-12s reads/s %8.1f   writes/s %8.1f   lock errors %d' % (profile,
+            c['reads'] / seconds, c['writes'] / seconds, c['errors']))
@@ -0,0 +1,76 @@
+#!/bin/python3
+
+# Benchmark of the pre-fork server: requests per second for a project page
+# (CPU bound rendering) with 1, 2, 4, ... worker processes, compared with the
+# threaded server in a single process. Each server is started on a scratch
+# database, and loaded by as many client processes as there are CPUs, each
+# with its own keep-alive connection. Run from anywhere:
+#
+#   python bench/bench_prefork.py [seconds per run] [max workers]
+
+import os, sys, time, socket, subprocess, http.client
+from multiprocessing import Pool
+import benchutil
+from benchutil import timelog
+
+port = 9998
+path = '/project/1'
+
+
+# Start the application, wait until it accepts connections
+def startServer(*args):
+    p = subprocess.Popen([sys.executable, 'timelog.py', '--port', str(port)] + list(args),
+            stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    for i in range(100):
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return p
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+# Client process: send requests for the given number of seconds
+def client(seconds):
+    c = http.client.HTTPConnection('localhost', port)
+    n = 0
+    t = time.time() + seconds
+    while time.time() < t:
+        c.request('GET', path)
+        c.getresponse().read()
+        n += 1
+    return n
+
+
+# Requests per second from all clients together
+def measure(nclients, seconds):
+    with Pool(nclients) as p:
+        return sum(p.map(client, [seconds] * nclients)) / seconds
+
+
+if __name__ == '__main__':
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    ncpu = os.cpu_count()
+    maxWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else ncpu
+    n = benchutil.makeDB(days = 730, perDay = 30, nproj = 20)
+    nclients = max(2, ncpu)
+    print('%d entries, %d CPUs, %d clients, GET %s' % (n, ncpu, nclients, path))
+
+    runs = [('threaded, 1 process', ['--server', 'threaded'])]
+    w = 1
+    while w <= maxWorkers:
+        runs.append(('prefork, %d worker%s' % (w, 's' if w > 1 else ''),
+            ['--server', 'prefork', '--workers', str(w)]))
+        w *= 2
+
+    base = None
+    for title, args in runs:
+        p = startServer(*args)
+        try:
+            rate = measure(nclients, seconds)
+        finally:
+            p.terminate()
+            p.wait()
+        base = base or rate
+        print('  %-22s %8.1f requests/sec  %5.2fx' % (title, rate, rate / base))
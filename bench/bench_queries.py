@@ -0,0 +1,70 @@
+#!/bin/python3
+
+# Benchmark of statement preparation on the queries of the project() and
+# edit_log() pages, for many different projects and log entries: the old
+# queries with the IDs formatted into the SQL text (a new statement to
+# prepare each time), the named queries with parameters but no statement
+# cache (prepared each time too), and the named queries with the statement
+# cache (prepared once). Run from anywhere:
+#
+#   python bench/bench_queries.py [requests]
+
+import sys, time, random
+import benchutil
+from benchutil import timelog
+from queries import query
+
+# The queries as they were before, with values in the SQL text
+old = {
+    'project': lambda cur, pid: [
+        cur.execute('select id, client, name, description, billable, active, complete, fees from project where id = %d' % pid),
+        cur.execute('select * from work where project_id = %d order by work_date' % pid),
+        cur.execute('select c.last_name, c.first_name, c.company, c.title from contact as c, project_contact as pc '
+            'where pc.project_id = %d and c.id = pc.contact_id order by c.last_name' % pid)],
+    'edit_log': lambda cur, lid: [
+        cur.execute('select * from work where id = %s' % lid),
+        cur.execute('select * from project where active order by client, name')],
+}
+
+# The same with named queries
+new = {
+    'project': lambda cur, pid: [
+        query(cur, 'project', pid),
+        query(cur, 'project_work', pid),
+        query(cur, 'project_people', pid)],
+    'edit_log': lambda cur, lid: [
+        query(cur, 'work_entry', lid),
+        query(cur, 'active_projects')],
+}
+
+
+# Run the queries of a page for random IDs, fetching all rows, return
+# milliseconds per page
+def measure(page, nreq, maxId, cachedStatements):
+    db = timelog.sql.connect(benchutil.dbname, cached_statements = cachedStatements)
+    cur = db.cursor()
+    random.seed(1)
+    t = time.perf_counter()
+    for i in range(nreq):
+        for c in page(cur, random.randint(1, maxId)):
+            c.fetchall()
+    t = time.perf_counter() - t
+    db.close()
+    return t / nreq * 1000.0
+
+
+if __name__ == '__main__':
+
+    nreq = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    nproj = 200
+    n = benchutil.makeDB(days = 365, perDay = 20, nproj = nproj)
+    print('%d entries, %d projects, %d pages each' % (n, nproj, nreq))
+    size = timelog.config['cached_statements']
+    for name, maxId in [('project', nproj), ('edit_log', n)]:
+        print('  %s()' % name)
+        base = measure(old[name], nreq, maxId, size)
+        runs = [('values in SQL text', base),
+            ('parameters, no cache', measure(new[name], nreq, maxId, 0)),
+            ('parameters, cache %d' % size, measure(new[name], nreq, maxId, size))]
+        for title, ms in runs:
+            print('    %-24s %7.3f ms/page  %5.2fx' % (title, ms, base / ms))
@@ -0,0 +1,99 @@
+#!/bin/python3
+
+# Micro-benchmark of rendering a 10,000 entry time log: the row templates
+# used by logRows() compared with the previous approach of writing each cell
+# to an io.StringIO, checking that both give exactly the same HTML. Run from
+# anywhere:
+#
+#   python bench/bench_render.py [entries]
+
+import io, sys, time, random
+from datetime import date, timedelta
+import benchutil
+from benchutil import timelog
+from timelog import parseDate, formatDate, fmtDate, ignoreProjectIDs, summaryRow
+
+
+# Previous rendering, one s.write() per cell
+def oldLogRows(work, wHrs, wBillable, mHrs, mBillable, nextDate):
+    s = io.StringIO()
+    dHrs = dBillable = 0.0
+    for i, w in enumerate(work):
+
+        wid, pid, client, projName, wdate, hrs, billable, descr = w
+        project = '%s - %s' % (client, projName)
+
+        ignoreRow = pid in ignoreProjectIDs
+        if not ignoreRow:
+            dHrs += hrs
+            if billable:
+                dBillable += hrs
+
+        if ignoreRow:
+            s.write('  <tr style="background-color: #fdd">\n')
+        else:
+            s.write('  <tr>\n')
+        s.write('    <td><a href="/project/%d">%s</a></td>\n' % (pid, project))
+        s.write('    <td align="right"><a href="edit_log/%s">%.2f</a></td>\n' % (wid, hrs))
+        if billable:
+            s.write('    <td align="right">%.2f</td>\n' % hrs)
+        else:
+            s.write('    <td>&nbsp;</td>\n')
+        s.write('<td>%s</td>' % descr)
+        s.write('  </tr>\n')
+
+        if i + 1 < len(work) and work[i + 1][4] == wdate:
+            continue
+        d = parseDate(wdate)
+        summaryRow(s, 'dtotal', formatDate(d), dHrs, dBillable)
+        dHrs = dBillable = 0.0
+        nd = parseDate(work[i + 1][4]) if i + 1 < len(work) else nextDate
+        if d and (not nd or nd - timedelta(nd.weekday()) != d - timedelta(d.weekday())):
+            k = fmtDate(d - timedelta(d.weekday()))
+            summaryRow(s, 'wtotal', 'Week subtotal:', wHrs.get(k, 0.0), wBillable.get(k, 0.0))
+        if d and (not nd or (nd.year, nd.month) != (d.year, d.month)):
+            k = fmtDate(d.replace(day = 1))
+            summaryRow(s, 'mtotal', 'Month subtotal', mHrs.get(k, 0.0), mBillable.get(k, 0.0))
+
+    return s.getvalue()
+
+
+# Time a function, best of a few runs, in milliseconds
+def best(f, *args, runs = 10):
+    tt = []
+    for i in range(runs):
+        t = time.perf_counter()
+        f(*args)
+        tt.append(time.perf_counter() - t)
+    return min(tt) * 1000.0
+
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    # Entries as returned by the time log query, 20 a day, some on ignored
+    # projects, with weekly and monthly totals
+    random.seed(1)
+    work = []
+    wHrs, wBillable, mHrs, mBillable = {}, {}, {}, {}
+    for i in range(n):
+        d = date(2017, 1, 1) + timedelta(i // 20)
+        pid = random.choice([1, 2, 3, 4, 5, 8])
+        hrs = random.choice([0.25, 0.5, 1.0, 2.0])
+        billable = random.randint(0, 1)
+        work.append((i + 1, pid, 'Client', 'Project %d' % pid, fmtDate(d), hrs, billable, 'Work item %d' % i))
+        wk = fmtDate(d - timedelta(d.weekday()))
+        mk = fmtDate(d.replace(day = 1))
+        for h, k in [(wHrs, wk), (mHrs, mk)]:
+            h[k] = h.get(k, 0.0) + hrs
+        for h, k in [(wBillable, wk), (mBillable, mk)]:
+            h[k] = h.get(k, 0.0) + (hrs if billable else 0.0)
+
+    args = (work, wHrs, wBillable, mHrs, mBillable, None)
+    old = oldLogRows(*args)
+    new = timelog.logRows(*args)
+    assert old == new, 'output differs'
+    print('%d entries, %d KB of HTML, identical output' % (n, len(new) // 1024))
+    print('  io.StringIO, s.write() per cell  %8.2f ms' % best(oldLogRows, *args))
+    print('  row templates, one join per day  %8.2f ms' % best(timelog.logRows, *args))
@@ -0,0 +1,69 @@
+#!/bin/python3
+
+# Benchmark of the full-text search: milliseconds per search (the first and
+# tenth page of results) for rare and common words, several words, and word
+# prefixes, on a work table with generated descriptions. Run from anywhere:
+#
+#   python bench/bench_search.py [entries]
+
+import sys, time, random
+from datetime import date, timedelta
+import benchutil
+from benchutil import timelog
+
+# Words for the descriptions, the first ones much more common than the last
+words = ['%s%s' % (a, b) for a in ['meet', 'call', 'draft', 'review', 'model', 'fix', 'plan', 'test',
+    'write', 'check', 'build', 'talk', 'send', 'read', 'edit', 'sync', 'port', 'load', 'map', 'sort']
+    for b in ['', 'ing', 'ed', 'er', 'ers', 'able', 'ment', 'ion', 'ive', 'ure', 'al', 'ous',
+    'ist', 'ism', 'ize', 'ly', 'ness', 'ship', 'ward', 'wise']]
+
+
+# Fill the scratch database with entries for nproj projects, descriptions
+# of 3 to 10 words
+def makeDB(n, nproj = 50):
+    timelog.migrate(benchutil.dbname, verbose = False)
+    db = timelog.sql.connect(benchutil.dbname)
+    timelog.applyProfile(db)
+    random.seed(3)
+    for i in range(1, nproj + 1):
+        db.execute("insert into project values (?, ?, ?, '', 1, 1, 0, 0)",
+                (i, 'Client %d' % (i % 10), 'Project %d' % i))
+    weights = [1.0 / (i + 1) for i in range(len(words))]
+    rows = []
+    for i in range(n):
+        descr = ' '.join(random.choices(words, weights, k = random.randint(3, 10)))
+        rows.append((i + 1, random.randint(1, nproj), (date(2000, 1, 1) + timedelta(i // 50)).isoformat(),
+            1.0, 1, descr))
+        if len(rows) == 10000:
+            db.executemany('insert into work values (?, ?, ?, ?, ?, ?)', rows)
+            rows = []
+    db.executemany('insert into work values (?, ?, ?, ?, ?, ?)', rows)
+    db.execute("insert into search (search) values ('optimize')")
+    db.commit()
+    db.close()
+
+
+# Median milliseconds for a search
+def measure(q, page, runs = 9):
+    db = timelog.sql.connect(benchutil.dbname)
+    timelog.applyProfile(db)
+    cur = db.cursor()
+    tt = []
+    for i in range(runs):
+        t = time.perf_counter()
+        results, more, capped = timelog.search(cur, q, page)
+        tt.append(time.perf_counter() - t)
+    db.close()
+    return sorted(tt)[runs // 2] * 1000.0, len(results)
+
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    t = time.perf_counter()
+    makeDB(n)
+    print('%d entries, indexed in %.1f sec' % (n, time.perf_counter() - t))
+    for q in ['meet', 'syncward', 'meet call', 'draft reviewing', 'client 3 fixed', 'revi*', 'mee*']:
+        for page in [1, 10]:
+            ms, nres = measure(q, page)
+            print('  %-20s page %2d  %7.1f ms  %d results' % ('"%s"' % q, page, ms, nres))
@@ -0,0 +1,50 @@
+#!/bin/python3
+
+# Benchmark of the session stores: JSON files, one per session (the old
+# store), compared with sessions kept in memory and written to the session
+# table in the background. Each request loads its session and saves it again,
+# like project_graph does, and one in ten requests changes a setting. Run
+# from anywhere:
+#
+#   python bench/bench_sessions.py [requests] [sessions]
+
+import sys, time, json, random, tempfile
+import benchutil
+from benchutil import timelog
+
+
+# Simulate requests from random sessions, return requests per second
+def simulate(store, nreq, sids):
+    random.seed(1)
+    t = time.perf_counter()
+    for i in range(nreq):
+        sid = random.choice(sids)
+        data = store.load(sid)
+        sess = json.loads(data) if data else {'sid': sid}
+        if random.random() < 0.1 or not data:
+            sess['period'] = random.choice(['30d', '90d', '180d', 'year', 'all'])
+            sess['stack'] = random.randint(0, 1)
+        store.save(sid, json.dumps(sess, sort_keys = True))
+    return nreq / (time.perf_counter() - t)
+
+
+if __name__ == '__main__':
+
+    nreq = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    nsess = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    timelog.migrate(benchutil.dbname, verbose = False)
+    sids = ['%032x' % random.getrandbits(128) for i in range(nsess)]
+    print('%d requests from %d sessions' % (nreq, nsess))
+
+    files = timelog.FileSessionStore(tempfile.mkdtemp())
+    print('  JSON file per session    %8.0f requests/sec' % simulate(files, nreq, sids))
+    print('    %s' % files.statistics())
+
+    # Write-behind thread off, flushed at the end instead
+    store = timelog.SessionStore(benchutil.dbname, interval = 3600)
+    rate = simulate(store, nreq, sids)
+    t = time.perf_counter()
+    store.flush()
+    print('  memory + session table   %8.0f requests/sec, flush %.1f ms' % (rate,
+        (time.perf_counter() - t) * 1000.0))
+    print('    %s' % store.statistics())
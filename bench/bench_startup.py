@@ -0,0 +1,45 @@
+#!/bin/python3
+
+# Benchmark of starting the application in a new process: importing
+# timelog, create_app(), migrate() on an up to date database, and the first
+# and second requests for the history page. Run from anywhere:
+#
+#   python bench/bench_startup.py [runs]
+
+import sys, json, subprocess
+import benchutil
+
+# Run in a new Python process, prints the times as JSON
+script = '''
+import time, json
+t0 = time.perf_counter()
+import timelog
+t1 = time.perf_counter()
+app = timelog.create_app()
+t2 = time.perf_counter()
+timelog.migrate(timelog.config['dbname'], verbose = False)
+t3 = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+tt = [t0, t1, t2, t3]
+for i in range(2):
+    env = {'PATH_INFO': '/'}
+    setup_testing_defaults(env)
+    b''.join(app(env, lambda status, headers, exc_info = None: None))
+    tt.append(time.perf_counter())
+print(json.dumps([b - a for a, b in zip(tt, tt[1:])]))
+'''
+
+if __name__ == '__main__':
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    n = benchutil.makeDB()
+    print('%d entries, median of %d runs' % (n, runs))
+    tt = []
+    for i in range(runs):
+        out = subprocess.run([sys.executable, '-c', script], cwd = benchutil.root,
+                capture_output = True, text = True, check = True).stdout
+        tt.append(json.loads(out.splitlines()[-1]))
+    for i, title in enumerate(['import timelog', 'create_app()', 'migrate(), up to date',
+            'first request', 'second request']):
+        t = sorted(r[i] for r in tt)[len(tt) // 2]
+        print('  %-24s %8.2f ms' % (title, t * 1000.0))
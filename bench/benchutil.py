@@ -0,0 +1,68 @@
+# Helpers shared by the benchmarks: a scratch database filled with generated
+# time log data, and a way to call the application without a server.
+# Import this before timelog, it points the application at the scratch
+# database.
+
+import os, sys, io, random, tempfile
+from datetime import date, timedelta
+from wsgiref.util import setup_testing_defaults
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root)   # for static files and create_database.sql
+dbname = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['TIMELOG_DBNAME'] = dbname
+
+import timelog
+app = timelog.create_app()
+
+
+# Fill the scratch database with entries for every day from start, with
+# perDay entries spread over nproj projects
+def makeDB(start = date(2017, 1, 1), days = 365, perDay = 20, nproj = 50, ncontacts = 100):
+    timelog.migrate(dbname, verbose = False)
+    db = timelog.sql.connect(dbname)
+    random.seed(1)
+    for i in range(1, nproj + 1):
+        db.execute("insert into project values (?, ?, ?, '', 1, 1, 0, 0)",
+                (i, 'Client %d' % (i % 10), 'Project %d' % i))
+    rows = []
+    for d in range(days):
+        ds = (start + timedelta(d)).isoformat()
+        for j in range(perDay):
+            rows.append((len(rows) + 1, random.randint(1, nproj), ds, random.choice([0.25, 0.5, 1.0, 2.0]),
+                random.randint(0, 1), 'Work item %d' % (len(rows) + 1)))
+    db.executemany('insert into work values (?, ?, ?, ?, ?, ?)', rows)
+    for i in range(1, ncontacts + 1):
+        db.execute("insert into contact values (?, ?, ?, ?, 'Title', '555-1234', 'Street\nCity', '', 1)",
+                (i, 'Last%04d' % i, 'First%d' % i, 'Company %d' % (i % 20)))
+    db.commit()
+    db.close()
+    return len(rows)
+
+
+# Call the application with a GET request, return status, headers and body
+def get(path, headers = {}):
+    status, hdrs, chunks = stream(path, headers)
+    body = b''.join(chunks)
+    if hasattr(chunks, 'close'):
+        chunks.close()
+    return status, hdrs, body
+
+
+# Call the application with a GET request, return status, headers and the
+# body as the application's iterable, to read a chunk at a time
+def stream(path, headers = {}):
+    env = {}
+    if '?' in path:
+        path, env['QUERY_STRING'] = path.split('?', 1)
+    env['PATH_INFO'] = path
+    for k, v in headers.items():
+        env['HTTP_' + k.upper().replace('-', '_')] = v
+    setup_testing_defaults(env)
+    result = {}
+    def start_response(status, hdrs, exc_info = None):
+        result['status'] = status
+        result['headers'] = dict(hdrs)
+    chunks = app(env, start_response)
+    return result['status'], result['headers'], chunks
@@ -0,0 +1,49 @@
+#!/bin/python3
+
+# Check with EXPLAIN QUERY PLAN that the date-filtered queries used by the
+# history, utilization, calendar, timesheet and report pages search an index
+# on the date (work_date, or the period of the rollup tables) rather than
+# scanning a whole table. The queries are those in queries.py, as the page
+# handlers run them. Run from the project directory:
+#
+#   python bench/explain_queries.py [database]
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if len(sys.argv) > 1:
+    os.environ['TIMELOG_DBNAME'] = sys.argv[1]
+else:
+    os.environ['TIMELOG_DBNAME'] = os.path.join(tempfile.mkdtemp(), 'explain.db')
+import timelog
+from queries import queries, totalsQuery
+
+start, end = timelog.monthRange(2017, 12)
+
+# Queries as issued by the page handlers, for one month, with parameters
+plans = {
+    'log': (queries['log_entries'], [start]),
+    'log (older)': (queries['log_entries_before'], [start, end, 0]),
+    'log / utilization totals': (totalsQuery('work_monthly', 2), [start, 0, 0]),
+    'calendar': (queries['calendar_month'], [start, end]),
+    'calendar (year)': (queries['calendar_year'], ['2017-01-01', '2018-01-01']),
+    'monthly_report': (queries['monthly_report'], [start]),
+    'timesheet': (queries['timesheet'], [start, end]),
+    'timesheet (week)': (queries['week_work'], [start, end]),
+    'project_graph': (queries['project_graph'], [start, end]),
+    'export': (queries['export_work'], [start, end]),
+}
+
+timelog.create_app()
+dbname = timelog.config['dbname']
+timelog.migrate(dbname, verbose = False)
+db = timelog.sql.connect(dbname)
+ok = True
+for name, (q, params) in plans.items():
+    plan = [r[3] for r in db.execute('explain query plan ' + q, params)]
+    uses = any(p.startswith('SEARCH') and ('work_date' in p or 'period' in p) for p in plan)
+    ok = ok and uses
+    print('%s: %s' % (name, 'uses date index' if uses else 'FULL SCAN'))
+    for p in plan:
+        print('    ' + p)
+sys.exit(0 if ok else 1)
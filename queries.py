@@ -0,0 +1,189 @@
+# SQL queries used by timelog.py, by name. Values are always passed as
+# parameters (?), never put into the SQL text, so that each query is only
+# prepared once per connection and then reused from sqlite3's statement
+# cache (see cached_statements in timelog.py).
+
+queries = {
+
+    # History page: dates of the most recent days, then the entries of those
+    # days, optionally before a (work_date, id) cursor
+    'log_days':
+        'select work_date from work group by work_date order by work_date desc limit ?',
+    'log_days_before':
+        'select work_date from work where (work_date, id) < (?, ?)'
+        ' group by work_date order by work_date desc limit ?',
+    'log_entries':
+        'select work.id, project_id, client, name, work_date, hours, work.billable, work.description'
+        ' from work, project where work.project_id = project.id and work_date >= ?'
+        ' order by work_date, work.id',
+    'log_entries_before':
+        'select work.id, project_id, client, name, work_date, hours, work.billable, work.description'
+        ' from work, project where work.project_id = project.id and work_date >= ?'
+        ' and (work_date, work.id) < (?, ?) order by work_date, work.id',
+
+    # Log entries
+    'work_entry':
+        'select * from work where id = ?',
+    'insert_work':
+        'insert into work (id, project_id, work_date, hours, billable, description) values (?, ?, ?, ?, ?, ?)',
+    'update_work':
+        'update work set project_id = ?, work_date = ?, hours = ?, billable = ?, description = ? where id = ?',
+    'update_work_hours':
+        'update work set hours = ? where id = ?',
+    'delete_work':
+        'delete from work where id = ?',
+    'week_work':
+        'select id, project_id, work_date, hours from work where work_date >= ? and work_date <= ? order by id',
+
+    # Projects
+    'active_projects':
+        'select * from project where active order by client, name',
+    'projects':
+        'select id, client, name, description, billable, active, fees from project order by client, name',
+    'project_names':
+        'select id, client, name, billable from project',
+    'project_hours':
+        'select project_id, sum(hours) from work group by project_id',
+    'project':
+        'select id, client, name, description, billable, active, complete, fees from project where id = ?',
+    'project_fields':
+        'select client, name, description, billable, active, complete, fees from project where id = ?',
+    'project_work':
+        'select * from work where project_id = ? order by work_date',
+    'insert_project':
+        'insert into project (id, client, name, description, billable, active, complete, fees)'
+        ' values (?, ?, ?, ?, ?, ?, ?, ?)',
+    'update_project':
+        'update project set client = ?, name = ?, description = ?, billable = ?, active = ?,'
+        ' complete = ?, fees = ? where id = ?',
+
+    # People on projects
+    'project_people':
+        'select c.last_name, c.first_name, c.company, c.title'
+        ' from contact as c, project_contact as pc'
+        ' where pc.project_id = ? and c.id = pc.contact_id order by c.last_name',
+    'project_members':
+        'select pc.id, c.id, c.last_name, c.first_name, c.company, c.title'
+        ' from contact as c, project_contact as pc'
+        ' where pc.project_id = ? and c.id = pc.contact_id order by c.last_name',
+    'insert_project_contact':
+        'insert into project_contact (id, project_id, contact_id) values (?, ?, ?)',
+    'delete_project_contact':
+        'delete from project_contact where id = ?',
+    'contact_projects':
+        'select p.id, p.client, p.name, p.active from project as p, project_contact as pc'
+        ' where pc.contact_id = ? and p.id = pc.project_id order by p.name',
+
+    # Contacts, a page at a time after a (last name, id) cursor (a missing
+    # last name counts as ''), or those
+    # whose last name, first name or company is from ?1 up to ?2 (i.e.,
+    # starts with a prefix), ignoring case
+    'contacts_page':
+        "select id, last_name, first_name, company, title, phones, address, active from contact"
+        " where coalesce(last_name, '') >= ?1 collate nocase"
+        " and (coalesce(last_name, '') > ?1 collate nocase or id > ?2)"
+        " order by coalesce(last_name, '') collate nocase, id limit ?3",
+    'contact_prefix':
+        'select id, last_name, first_name, company, title, phones, address, active from contact where id in ('
+        ' select id from (select id from contact where last_name >= ?1 collate nocase and last_name < ?2 collate nocase'
+        ' order by last_name collate nocase limit ?3)'
+        ' union select id from (select id from contact where first_name >= ?1 collate nocase and first_name < ?2 collate nocase'
+        ' order by first_name collate nocase limit ?3)'
+        ' union select id from (select id from contact where company >= ?1 collate nocase and company < ?2 collate nocase'
+        ' order by company collate nocase limit ?3))'
+        ' order by last_name collate nocase, first_name collate nocase, id limit ?3',
+    'contact':
+        'select id, last_name, first_name, company, title, phones, address, comments, active'
+        ' from contact where id = ?',
+    'insert_contact':
+        'insert into contact (id, last_name, first_name, company, title, phones, address, comments, active)'
+        ' values (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+    'update_contact':
+        'update contact set last_name = ?, first_name = ?, company = ?, title = ?, phones = ?,'
+        ' address = ?, comments = ?, active = ? where id = ?',
+
+    # Exports, in the order of the columns in timelog.exportColumns
+    'export_work':
+        'select w.id, w.work_date, p.client, p.name, w.project_id, w.hours, w.billable, w.description'
+        ' from work as w, project as p where p.id = w.project_id and w.work_date >= ? and w.work_date <= ?'
+        ' order by w.work_date, w.id',
+    'export_project_work':
+        'select w.id, w.work_date, p.client, p.name, w.project_id, w.hours, w.billable, w.description'
+        ' from work as w, project as p where p.id = w.project_id and w.project_id = ?'
+        ' and w.work_date >= ? and w.work_date <= ? order by w.work_date, w.id',
+    'export_projects':
+        'select id, client, name, description, billable, active, complete, fees from project order by id',
+    'export_project':
+        'select id, client, name, description, billable, active, complete, fees from project where id = ?',
+    'export_contacts':
+        'select id, last_name, first_name, company, title, phones, address, comments, active'
+        ' from contact order by id',
+    'export_project_contacts':
+        'select c.id, c.last_name, c.first_name, c.company, c.title, c.phones, c.address, c.comments, c.active'
+        ' from contact as c, project_contact as pc where pc.project_id = ? and c.id = pc.contact_id'
+        ' order by c.id',
+
+    # Full-text search: the rowid of the newest match after the given number
+    # of most recent ones (none if there are no more), then the matches
+    # newer than that, with the words found between char(2) and char(3)
+    'search_cutoff':
+        'select rowid from search where search match ? order by rowid desc limit 1 offset ?',
+    'search':
+        'select kind, ref, date, highlight(search, 3, char(2), char(3)), highlight(search, 4, char(2), char(3))'
+        ' from search where search match ? and rowid > ? order by rowid desc',
+
+    # Calendar, from the daily rollup
+    'calendar_month':
+        'select substr(r.period,9,2), p.id, p.name, sum(r.hours), r.billable'
+        ' from project as p, work_daily as r'
+        ' where p.id = r.project_id and r.period >= ? and r.period < ?'
+        ' group by substr(r.period,9,2), p.id, p.name, r.billable',
+    'calendar_year':
+        'select period, sum(hours), sum(case when billable then hours else 0 end)'
+        ' from work_daily where period >= ? and period < ? group by period',
+
+    # Reports, from the rollup tables
+    'monthly_report':
+        'select p.client, p.name, sum(r.hours) from work_monthly as r, project as p'
+        ' where r.project_id = p.id and r.period = ?'
+        ' group by p.client, p.name order by client',
+    'timesheet_projects':
+        'select id, client, name, billable from project where active'
+        ' or id in (select project_id from work where work_date >= ? and work_date <= ?)'
+        ' order by client, name',
+    'timesheet':
+        'select p.client, p.name, r.period, sum(r.hours) from work_daily as r, project as p'
+        ' where r.project_id = p.id and r.period >= ? and r.period <= ?'
+        ' group by p.client, p.name, r.period order by p.client, p.name, r.period',
+    'project_graph':
+        'select r.period, p.client, p.name, sum(r.hours) from work_daily as r, project as p'
+        ' where r.project_id = p.id and r.period >= ? and r.period <= ?'
+        ' group by r.period, p.client, p.name order by r.period, min(r.project_id)',
+
+    # Data version, incremented by triggers whenever the data changes, and
+    # by hand after rebuilding the rollups
+    'data_version':
+        'select version from data_version',
+    'bump_data_version':
+        'update data_version set version = version + 1',
+}
+
+
+# Total and billable hours for each period of a rollup table from a start
+# date, leaving out some projects. The table name and the number of projects
+# left out are part of the SQL; the start date and project IDs are
+# parameters.
+def totalsQuery(table, nignore):
+    return ('select r.period, sum(r.hours), sum(case when r.billable then r.hours else 0 end)'
+        ' from %s as r, project as p where r.project_id = p.id and r.period >= ?'
+        ' and r.project_id not in (%s) group by r.period') % (table, ','.join(['?'] * nignore))
+
+
+# Run a named query with the given parameters, return the cursor
+def query(cur, name, *params):
+    return cur.execute(queries[name], params)
+
+
+# Run a named query once for each sequence of parameters
+def queryMany(cur, name, rows):
+    return cur.executemany(queries[name], rows)
@@ -0,0 +1,43 @@
+/*
+ * Typeahead for contacts: as a name is typed into a field, list the
+ * contacts whose last name, first name or company start with it, from
+ * /contacts.json. The field's data attributes give the id of the list, the
+ * most contacts to show, the link for each contact (with {id} for its ID),
+ * the label of a button for the link (or the name is the link), and IDs of
+ * contacts to leave out.
+ */
+
+function contactTypeahead(field) {
+    var q = field.value.trim();
+    var list = document.getElementById(field.dataset.list);
+    if ( !q ) {
+        list.innerHTML = "";
+        return;
+    }
+    var exclude = (field.dataset.exclude || "").split(",");
+    var url = "/contacts.json?limit=" + field.dataset.limit + "&q=" + encodeURIComponent(q);
+    fetch(url).then(function(r) { return r.json(); }).then(function(result) {
+
+        // Ignore the answer if more has been typed meanwhile
+        if ( field.value.trim() != q )
+            return;
+
+        var html = "";
+        result.contacts.forEach(function(c) {
+            if ( exclude.indexOf(String(c.id)) >= 0 )
+                return;
+            var href = field.dataset.href.replace("{id}", c.id);
+            var name = escapeHTML(c.first_name + " " + c.last_name);
+            var info = " (" + escapeHTML(c.title) + ", " + escapeHTML(c.company) + ")";
+            if ( field.dataset.label )
+                html += "<li>" + name + info + ' <a href="' + href + '" class="button">' + field.dataset.label + "</a></li>\n";
+            else
+                html += '<li><a href="' + href + '">' + name + "</a>" + info + "</li>\n";
+        });
+        list.innerHTML = html || "<li>No contacts found</li>";
+    });
+}
+
+function escapeHTML(s) {
+    return String(s == null ? "" : s).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+}
@@ -0,0 +1,30 @@
+/*
+ * Load older days into the time log table, a page at a time
+ */
+
+function loadOlder(link) {
+    var url = "/log/older?date=" + encodeURIComponent(link.dataset.date) + "&id=" + link.dataset.id;
+    fetch(url).then(function(r) {
+        if ( !r.ok )
+            throw new Error(r.statusText);
+        return r.json();
+    }).then(function(page) {
+
+        // Put the rows after the row with the link, i.e., above the
+        // ones already shown
+        var row = document.getElementById("older");
+        row.insertAdjacentHTML("afterend", page.html);
+
+        // Next page starts before the oldest entry shown
+        link.dataset.date = page.date;
+        link.dataset.id = page.id;
+        link.href = "/?date=" + encodeURIComponent(page.date) + "&id=" + page.id;
+        if ( !page.more )
+            row.style.display = "none";
+    }).catch(function() {
+
+        // Could not load them here, show the older page instead
+        window.location.href = link.href;
+    });
+    return false;   // don't follow the link
+}
@@ -1,27 +1,123 @@
 #!/bin/python3
 
-import os, io, uuid, socket, json
+import time
+started = time.perf_counter()   # to report the startup time
+
+import os, sys, io, re, uuid, socket, json, threading, configparser, argparse
+import gzip, zlib, hashlib, mimetypes, queue, signal, traceback, bisect, csv, math, select
 from sqlite3 import dbapi2 as sql
 from datetime import date, datetime, timedelta
-from bottle import route, post, run, request, response, static_file, redirect
-
-# Name of SQLite database 
-dbname = 'timelog.db'
+from collections import OrderedDict
+from urllib.parse import urlencode
+from queries import query, queryMany, totalsQuery
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
+from bottle import route, post, run, request, response, static_file, redirect, \
+        default_app, HTTPError, HTTPResponse, ServerAdapter
+
+# Brotli compression of static files is optional
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Default settings. These can be changed in the [timelog] section of
+# timelog.ini, or with environment variables named TIMELOG_ and the setting
+# in upper case (e.g., TIMELOG_POOL_SIZE=4), which take precedence, or by
+# passing them to create_app().
+config = {
+
+    # Name of SQLite database 
+    'dbname': 'timelog.db',
+
+    # Maximum number of database connections kept open at the same time
+    'pool_size': 8,
+
+    # SQLite settings applied to each new connection: 'performance' uses the
+    # PRAGMA values below, 'default' leaves SQLite's defaults unchanged
+    'db_profile': 'performance',
+    'journal_mode': 'wal',          # readers don't block the writer
+    'synchronous': 'normal',        # safe with WAL, fewer fsyncs
+    'cache_size': -16000,           # page cache, negative = KiB
+    'mmap_size': 268435456,         # memory-mapped I/O, bytes
+    'temp_store': 'memory',
+    'busy_timeout': 5000,           # wait this many ms for a lock
+
+    # Prepared statements kept by each connection for reuse, more than the
+    # number of different queries in queries.py
+    'cached_statements': 128,
+
+    # Number of days shown at a time on the history page
+    'log_page_days': 31,
+
+    # Seconds between checks for changes to cached static fragments
+    'fragment_check_interval': 2.0,
+
+    # Seconds browsers may keep static files requested with a content hash
+    'asset_max_age': 31536000,
+
+    'optimize_interval': 3600,      # seconds between PRAGMA optimize
+
+    # Pages at least this many bytes are gzipped, if the browser accepts it
+    'compress_min_size': 1024,
+    'compress_level': 6,            # 1 = fastest, 9 = smallest
+
+    # Contacts on each page of the list, and the most suggested as a name is
+    # typed
+    'contacts_page_size': 100,
+    'typeahead_limit': 20,
+
+    # Results on each page of a search, and the most results for a search:
+    # the most recent matches, ranked by relevance
+    'search_page_size': 20,
+    'search_rank_limit': 1000,
+
+    # Rows read from the database and sent at a time by the exports
+    'export_chunk_rows': 1000,
+
+    # Web server: 'threaded' handles requests in a pool of worker threads,
+    # 'prefork' in several processes each with a pool of threads, 'wsgiref'
+    # one at a time
+    'server': 'threaded',
+    'host': 'localhost',
+    'port': 9999,
+    'threads': 8,
+    'workers': 0,                   # processes for 'prefork', 0 = one per CPU
+    'queue_size': 64,               # connections waiting for a thread
+    'keepalive_timeout': 5.0,       # seconds an idle connection is kept open
+    'shutdown_timeout': 10.0,       # seconds to finish requests at shutdown
+
+    # Collect request and SQL timings for /metrics
+    'metrics': True,
+
+    # Record the SQL statements of each request, shown on /debug/sql
+    'sql_trace': False,
+    'slow_query_ms': 50.0,          # log statements slower than this
+    'repeated_queries': 10,         # flag statements run this often per request
+    'trace_requests': 50,           # number of recent requests kept
+
+    # Memory used for report pages kept until the data changes, bytes
+    'response_cache_size': 8388608,
+
+    # Sessions are kept in memory and saved to the session table ('db'),
+    # or kept in JSON files in session_dir ('file')
+    'session_store': 'db',
+    'session_dir': '/tmp/sessions',
+    'session_ttl': 2592000,         # seconds a session is kept if not used
+    'session_cache_size': 1000,     # sessions kept in memory
+    'session_flush_interval': 5.0,  # seconds between saves of changed sessions
+}
+
+
+# Read settings from config file and environment, converting values to
+# the type of the default
+def loadConfig(fname = 'timelog.ini'):
+    cp = configparser.ConfigParser()
+    cp.read(fname)
+    for k, v in config.items():
+        s = os.environ.get('TIMELOG_' + k.upper(), cp.get('timelog', k, fallback = None))
+        if s is not None:
+            config[k] = isTrue(s) if type(v) is bool else type(v)(s)
 
-# The time log should only include the last 6 months (180 days)
-t0 = datetime.now() - timedelta(180)
-this_month = '%d-%02d' % (t0.year, t0.month)
-
-# If database does not yet exist, create it
-if not os.path.exists(dbname):
-    print('Database %s not found, creating it' % dbname)
-    db = sql.connect(dbname)
-    cur = db.cursor()
-    for r in open('create_database.sql'):
-        print(r)
-        cur.execute(r)
-    db.commit()
-    db.close()
 
 # List of project IDs to ignore when calculating utilization (e.g., holidays)
 # TODO: don't hardcode this, or use names instead of IDs
@@ -29,11 +125,6 @@ ignoreProjectIDs = [8,  # Personal: Time off
     84,                 # Personal: Weekends
     193]                # ThinkBig: Sick
 
-# Where sessions go
-session_dir = '/tmp/sessions'
-if not os.path.exists(session_dir):
-    print('Creating session directory:', session_dir)
-    os.mkdir(session_dir)
 
 
 #--------------------------------------------------------------------#
@@ -45,7 +136,9 @@ if not os.path.exists(session_dir):
 def favicon():
     return ''
 
-# Show time log, most recent at the top
+# Show time log, most recent at the bottom. Only the last few days are
+# shown, older ones are fetched a page at a time by /log/older, starting at
+# the cursor (date and id of the oldest entry shown) given in the URL.
 @route('/')
 def log():
 
@@ -69,105 +162,179 @@ def log():
         s.write('    <th>%s</th>\n' % h)
     s.write('  </tr>\n')
 
-    # Initialize counters, etc.  
-    lastDate = None
-    dHrs = dBillable = 0.0
-    wHrs = wBillable = 0.0
-    mHrs = mBillable = 0.0
-    totalHrs = totalBillable = 0
-
-    # Get the time log records for the current year
-    # PROBLEM: the counters will be out or missed, if there are gaps in the dates
-    q = 'select work.id, project_id, client, name, work_date, hours, work.billable, work.description '
-    q += ' from work, project where work.project_id = project.id'
-    q += " and substr(work_date,1,7) >= '%s'" % this_month
-    q += ' order by work_date'  # desc limit 400'
-    cur.execute(q)
+    # Most recent days, or the page before the cursor
+    before = logCursor()
+    html, cursor, more = logPage(cur, config['log_page_days'], before)
+
+    # Link to load older days into the table
+    if more:
+        s.write('  <tr id="older">\n')
+        s.write('    <td colspan="4"><a href="/?date=%s&id=%d" class="button" onclick="return loadOlder(this)" ' % cursor)
+        s.write('data-date="%s" data-id="%d">Show older entries</a></td>\n' % cursor)
+        s.write('  </tr>\n')
+    s.write(html)
+
+    # Grand total for the time log period (not only the days shown),
+    # ignoring some projects
+    start = logStart()
+    hrs, billable = rollupTotals(cur, 'work_monthly', start)
+    summaryRow(s, 'total', 'Total since %s' % formatDate(parseDate(start)), sum(hrs.values()), sum(billable.values()))
+    s.write('</table>\n')
+
+    # href to bottom, hyperlink to top
+    s.write('<a name="bottom"></a>')
+    s.write('<p style="font-size: 0.8em; font-weight: bold; float: right"><a href="#top">Go to top</a></p>\n')
+    s.write('<script language="JavaScript" type="text/javascript" src="%s"></script>\n' % assetUrl('log.js'))
+
+    # Finish page
+    footer(s)
+    return s.getvalue()
+
+
+# Get a page of older time log days, before the cursor, as JSON: the table
+# rows, the cursor for the next page, and whether there are more
+@route('/log/older')
+def log_older():
+    db = getDB()
+    cur = db.cursor()
+    before = logCursor()
+    try:
+        ndays = int(request.query.days) if request.query.days else config['log_page_days']
+    except ValueError:
+        raise HTTPError(400, 'Days must be a number')
+    ndays = min(max(ndays, 1), 366)
+    html, cursor, more = logPage(cur, ndays, before)
+    return {'html': html, 'date': cursor[0], 'id': cursor[1], 'more': more}
+
+
+# Cursor (date, id) from the URL, or None for the most recent entries
+def logCursor():
+    if 'date' in request.query and 'id' in request.query:
+        try:
+            return request.query.date, int(request.query.id)
+        except ValueError:
+            raise HTTPError(400, 'Entry ID must be a number')
+    return None
+
+
+# Render the table rows for the ndays days of the time log before the cursor
+# (or the most recent days), with daily, weekly and monthly subtotals. Returns
+# the HTML, the cursor of the oldest entry shown, and whether there are older
+# entries. Entries are selected by (work_date, id) ranges, so each page is a
+# search of the date index, however much history there is.
+def logPage(cur, ndays, before = None):
+
+    # Dates of the days on this page, plus one to see if there are more
+    if before:
+        query(cur, 'log_days_before', before[0], before[1], ndays + 1)
+    else:
+        query(cur, 'log_days', ndays + 1)
+    days = [r[0] for r in cur.fetchall()]
+    more = len(days) > ndays
+    if not days:
+        return '', before or ('', 0), False
+    days = days[:ndays]
+
+    # Get the time log entries for those days
+    if before:
+        query(cur, 'log_entries_before', days[-1], before[0], before[1])
+    else:
+        query(cur, 'log_entries', days[-1])
     work = cur.fetchall()
 
-    # Show each time log record
-    data = 0
-    for w in work:
+    # Weekly and monthly subtotals from the rollup tables
+    d0 = parseDate(days[-1])
+    if d0:
+        wHrs, wBillable = rollupTotals(cur, 'work_weekly', fmtDate(d0 - timedelta(d0.weekday())))
+        mHrs, mBillable = rollupTotals(cur, 'work_monthly', fmtDate(d0.replace(day = 1)))
+    else:
+        wHrs = wBillable = mHrs = mBillable = {}
+
+    # The day after the page (if any), to know whether the last week and month
+    # on this page are complete
+    nextDate = parseDate(before[0]) if before else None
+
+    html = logRows(work, wHrs, wBillable, mHrs, mBillable, nextDate)
+    cursor = (work[0][4], work[0][0]) if work else (days[-1], 0)
+    return html, cursor, more
 
-        wid, pid, client, projName, wdate, hrs, billable, descr = w
-        project = '%s - %s' % (client, projName)
-        wdate = parseDate(wdate)
 
-        # If date has changed, show summary for the date, and the week if has changed,
-        # and end of month
-        if lastDate and lastDate != wdate:
+# Row template for a time log entry, with variants for (ignored project,
+# billable)
+logEntry = dict((
+    (ignore, billable),
+    ('  <tr style="background-color: #fdd">\n' if ignore else '  <tr>\n') +
+    '    <td><a href="/project/%d">%s</a></td>\n' +
+    '    <td align="right"><a href="edit_log/%s">%.2f</a></td>\n' +
+    ('    <td align="right">%.2f</td>\n' if billable else '    <td>&nbsp;</td>\n') +
+    '<td>%s</td>  </tr>\n')
+    for ignore in [False, True] for billable in [False, True])
 
-            # Summary for this date
-            summaryRow(s, 'dtotal', formatDate(lastDate), dHrs, dBillable)
-            dHrs = dBillable = data = 0.0
 
-            # If just finished a Friday, show summary for the date
-            if lastDate.weekday() == 4:   # 0 = Monday
-                summaryRow(s, 'wtotal', 'Week subtotal:', wHrs, wBillable)
-                wHrs = wBillable = 0.0
+# Render time log entries as table rows, with a summary row at the end of each
+# day, and of each week and month using the given totals. The day after the
+# entries (if any) tells whether the last week and month are complete.
+def logRows(work, wHrs, wBillable, mHrs, mBillable, nextDate):
 
-            # If will be starting a new month, show summary for the date
-            if lastDate.month != wdate.month:
-                summaryRow(s, 'mtotal', 'Month subtotal', mHrs, mBillable)
-                mHrs = mBillable = 0.0
+    out = []
+    rows = []   # entries for the current day, as (variant, values)
+    dHrs = dBillable = 0.0
+    n = len(work)
+    for i, w in enumerate(work):
+
+        wid, pid, client, projName, wdate, hrs, billable, descr = w
+        project = '%s - %s' % (client, projName)
 
         # Update counters
-        lastDate = wdate
         ignoreRow = pid in ignoreProjectIDs
         if not ignoreRow:
             dHrs += hrs
-            wHrs += hrs
-            mHrs += hrs
-            totalHrs += hrs
             if billable:
                 dBillable += hrs
-                wBillable += hrs
-                mBillable += hrs
-                totalBillable += hrs
 
-        # Show row for this timelog entry, with link to edit
-        if ignoreRow:
-            s.write('  <tr style="background-color: #fdd">\n')
-        else:
-            s.write('  <tr>\n')
-        s.write('    <td><a href="/project/%d">%s</a></td>\n' % (pid, project))
-        s.write('    <td align="right"><a href="edit_log/%s">%.2f</a></td>\n' % (wid, hrs))
+        # Row for this timelog entry, with link to edit
         if billable:
-            s.write('    <td align="right">%.2f</td>\n' % hrs)
+            rows.append(((ignoreRow, True), (pid, project, wid, hrs, hrs, descr)))
         else:
-            s.write('    <td>&nbsp;</td>\n')
-        s.write('<td>%s</td>' % descr)
-        s.write('  </tr>\n')
-
-    # Final subtotals, by day, week, month, and grand total
-    summaryRow(s, 'dtotal', formatDate(lastDate), dHrs, dBillable)
-    summaryRow(s, 'wtotal', 'Week subtotal:', wHrs, wBillable)
-    summaryRow(s, 'mtotal', 'Month subtotal', mHrs, mBillable)
-    summaryRow(s, 'total', 'Total', totalHrs, totalBillable)
-    s.write('</table>\n')
+            rows.append(((ignoreRow, False), (pid, project, wid, hrs, descr)))
 
-    # href to bottom, hyperlink to top
-    s.write('<a name="bottom"></a>')
-    s.write('<p style="font-size: 0.8em; font-weight: bold; float: right"><a href="#top">Go to top</a></p>\n')
+        # If last entry for the date, show the day's entries and summary for
+        # the date, and the week and month if they are finished
+        if i + 1 < n and work[i + 1][4] == wdate:
+            continue
+        out.append(renderRows(logEntry, rows))
+        rows = []
+        d = parseDate(wdate)
+        out.append(summaryHTML('dtotal', formatDate(d), dHrs, dBillable))
+        dHrs = dBillable = 0.0
+        nd = parseDate(work[i + 1][4]) if i + 1 < n else nextDate
+        if d and (not nd or nd - timedelta(nd.weekday()) != d - timedelta(d.weekday())):
+            k = fmtDate(d - timedelta(d.weekday()))
+            out.append(summaryHTML('wtotal', 'Week subtotal:', wHrs.get(k, 0.0), wBillable.get(k, 0.0)))
+        if d and (not nd or (nd.year, nd.month) != (d.year, d.month)):
+            k = fmtDate(d.replace(day = 1))
+            out.append(summaryHTML('mtotal', 'Month subtotal', mHrs.get(k, 0.0), mBillable.get(k, 0.0)))
 
-    # Finish page
-    footer(s)
-    return s.getvalue()
+    return ''.join(out)
 
 
 # Print a summary row, every time the date, week, or month changes, and at the end
 def summaryRow(s, cls, title, hours, billable):
-    if cls == 'total':
-        rid = 'href="#totals"'
-    else:
-        rid = ''
-    s.write('  <tr class="%s" %s>\n' % (cls, rid))
-    s.write('    <td>%s</td>\n' % title)
-    s.write('    <td align="right">%.2f</td>\n' % hours)
-    s.write('    <td align="right">%.2f</td>\n' % billable)
+    s.write(summaryHTML(cls, title, hours, billable))
+
+
+# Summary row template, and the HTML for one summary row
+summaryTemplate = ('  <tr class="%s" %s>\n'
+    '    <td>%s</td>\n'
+    '    <td align="right">%.2f</td>\n'
+    '    <td align="right">%.2f</td>\n'
+    '    <td>%.1f%% productive</td>\n'
+    '  </tr>\n')
+
+def summaryHTML(cls, title, hours, billable):
+    rid = 'href="#totals"' if cls == 'total' else ''
     billPcnt = billable / hours * 100.0 if hours > 0.0 else 0.0
-    s.write('    <td>%.1f%% productive</td>\n' % billPcnt)
-    s.write('  </tr>\n')
+    return summaryTemplate % (cls, rid, title, hours, billable, billPcnt)
 
 
 #--------------------------------------------------------------------#
@@ -196,7 +363,7 @@ def edit_log(lid):
     # Initialize fields
     if lid:
         s.write('<h1>Edit Log Entry</h1>\n')
-        cur.execute('select * from work where id = %s' % lid)
+        query(cur, 'work_entry', lid)
         w = cur.fetchone()
         lid, project, wdate, hours, billable, description = w 
         d = parseDate(wdate)
@@ -221,7 +388,7 @@ def edit_log(lid):
     td(s, 'Project')
     s.write('<td>\n')
     s.write('<select name="project" class="field" style="font-family: monospace">\n')
-    cur.execute('select * from project where active order by client, name')
+    query(cur, 'active_projects')
     for p in cur.fetchall():
         selected = 'selected' if p[0] == project else ''
         s.write('<option %s value="%s">%s - %s</option>\n' % (selected, p[0], p[1], p[2]))
@@ -266,20 +433,15 @@ def save_log():
     hours = float(request.forms.hours)
     billable = 1 if 'billable' in request.forms else 0
     descr = request.forms.description
-    descr = descr.replace("'", "\\'")   # TODO: encoding?
 
     # TODO: validate
 
     # Save data
     if lid > 0:
-        q = "update work set project_id = %d, work_date = '%s', hours = %.2f, "
-        q += "billable = %d, description = '%s' where id = %d"
-        q = q % (pid, wdate, hours, billable, descr, lid)
+        query(cur, 'update_work', pid, fmtDate(wdate), round(hours, 2), billable, descr, lid)
     else:
         wid = nextId('work', cur)
-        q = "insert into work values (%d, '%s', '%s', %f , '%s', '%s')" 
-        q = q % (wid, pid, wdate, hours, billable, descr)
-    cur.execute(q)
+        query(cur, 'insert_work', wid, pid, fmtDate(wdate), hours, billable, descr)
     db.commit()
     redirect('/#bottom')
 
@@ -305,13 +467,13 @@ def save_log():
 
 
 # Default is to show just active projects, if no state specified
-@route('/projects')
+@route('/projects', cache = True)
 def projects1():
     return projects('active')
 
 
 # Show list of projects: all, active, ...
-@route('/projects/<show>')
+@route('/projects/<show>', cache = True)
 def projects(show):
 
     # Connect to database
@@ -320,7 +482,7 @@ def projects(show):
 
     # Get hours per project into a dictionary
     project_hours = {}  # keyed by project id
-    cur.execute('select project_id, sum(hours) from work group by project_id')
+    query(cur, 'project_hours')
     for r in cur.fetchall():
         p, h = r
         project_hours[p] = float(h)
@@ -346,7 +508,7 @@ def projects(show):
 
     # Get projects and show in table
     count = 0
-    cur.execute('select id, client, name, description, billable, active, fees from project order by client, name')
+    query(cur, 'projects')
     for p in cur.fetchall():
 
         pid, client, name, descr, billable, active, fees = p
@@ -404,7 +566,7 @@ def project(pid):
     # Get the project to show, exit if not found
     db = getDB()
     cur = db.cursor()
-    cur.execute('select id, client, name, description, billable, active, complete, fees from project where id = %d' % pid)
+    query(cur, 'project', pid)
     p = cur.fetchone()
     if not p:
         s.write('<p>Project id %d not found</p>' % pid)
@@ -434,8 +596,9 @@ def project(pid):
     totMthHrs = {}
     totMthBHrs = {}
     prevMonth = -1
-    cur.execute('select * from work where project_id = %d order by work_date' % pid)
+    query(cur, 'project_work', pid)
     ww = cur.fetchall()
+    rows = []  # table rows, as (variant, values)
     for w in ww:
 
         wid, pid, wdate, hours, billable, descr = w
@@ -444,12 +607,7 @@ def project(pid):
 
         # Heading at beginning of each month
         if wdate.month != prevMonth:
-            s.write('<tr class="heading">')
-            s.write('<td width=150>Date</td>')
-            td(s, 'Hours')
-            td(s, 'Billable')
-            td(s, 'Description')
-            s.write('</tr>')
+            rows.append(('heading', ()))
             prevMonth = wdate.month
 
         # Totals
@@ -463,15 +621,8 @@ def project(pid):
             totMthBHrs[mth] += hrs
 
         # Show row
-        s.write('<tr class="data">')
-        td(s, '<a href="/edit_log/%d">%s</a>' % (wid, formatDate(wdate)))
-        s.write('<td align="right">%.1f</td>' % hrs)
-        if billable:
-            s.write('<td style="text-align: center; background: #5f5">Yes</td>')
-        else:
-            s.write('<td style="text-align: center; color: #aaa">No</td>')
-        td(s, descr)
-        s.write('</tr>')
+        rows.append((bool(billable), (wid, formatDate(wdate), hrs, descr)))
+    s.write(renderRows(projectEntry, rows))
 
     # Totals row
     s.write('<tr class="total"><td>Total</td><td align="right">%.1f</td><td>&nbsp;</td><td>%.1f days</td></tr>' % (totHrs, totHrs / 8.0))
@@ -517,11 +668,7 @@ def project(pid):
 
     # Show contacts on this project (both colleagues and clients)
     s.write('<h2>Contacts on this Project</h2>\n')
-    q = 'select c.last_name, c.first_name, c.company, c.title '
-    q += 'from contact as c, project_contact as pc '
-    q += 'where pc.project_id = %d and c.id = pc.contact_id ' % pid
-    q += 'order by c.last_name'
-    cur.execute(q)
+    query(cur, 'project_people', pid)
     pcc = cur.fetchall()
     if len(pcc) == 0:
         s.write('<p>No people on this project</p>\n')
@@ -538,6 +685,16 @@ def project(pid):
     return(s.getvalue())
 
 
+# Row template for the log entries on the project page: month headings, and
+# entries that are billable or not
+projectEntry = {
+    'heading': '<tr class="heading"><td width=150>Date</td><td>Hours</td><td>Billable</td><td>Description</td></tr>',
+    True: '<tr class="data"><td><a href="/edit_log/%d">%s</a></td><td align="right">%.1f</td>'
+        '<td style="text-align: center; background: #5f5">Yes</td><td>%s</td></tr>',
+    False: '<tr class="data"><td><a href="/edit_log/%d">%s</a></td><td align="right">%.1f</td>'
+        '<td style="text-align: center; color: #aaa">No</td><td>%s</td></tr>'}
+
+
 # Show form to edit/create a project
 @route('/edit_project/<pid:int>')
 def edit_project(pid):
@@ -560,7 +717,7 @@ def edit_project(pid):
 
     # Get existing values if editing a project
     if pid > 0:
-        cur.execute('select client, name, description, billable, active, complete, fees from project where id = %d' % pid)
+        query(cur, 'project_fields', pid)
         client, name, description, billable, active, complete, fees = cur.fetchone()
         complete = float(complete) if complete else 0.0
         fees = float(fees) if fees else 0.0
@@ -586,8 +743,6 @@ def edit_project(pid):
     s.write('<input type="submit" value="Save" class="button">')
     s.write('</form>')
 
-    db.close()
-
     footer(s)
     return s.getvalue()
 
@@ -639,14 +794,13 @@ def save_project():
         db = getDB()
         cur = db.cursor()
         if pid > 0:
-            q = "update project set client = '%s', name = '%s', description = '%s' , billable = %d , active = %d, complete = %.1f, fees = %.2f where id = %s" % (client, name, description, billable, active, complete, fees, pid)
+            query(cur, 'update_project', client, name, description, billable, active,
+                    round(complete, 1), round(fees, 2), pid)
         else:
             pid = nextId('project', cur)
-            q = "insert into project values (%d, '%s', '%s', '%s' , %d , %d, %.1f, %.2f)" % \
-                    (pid, client, name, description, billable, active, complete, fees)
-        cur.execute(q)
+            query(cur, 'insert_project', pid, client, name, description, billable, active,
+                    round(complete, 1), round(fees, 2))
         db.commit()
-        db.close()
         redirect('/project/%d' % pid)
 
     # Show validation errors
@@ -663,7 +817,7 @@ def save_project():
 
 
 # For to add/remove people from a project
-@route('/project_contacts/<pid:int>')
+@route('/project_contacts/<pid:int>', etag = False)
 def project_contacts(pid):
 
     # Start page
@@ -679,23 +833,19 @@ def project_contacts(pid):
     if 'add' in request.query:
         cid = int(request.query.add)
         pcid = nextId('project_contact', cur)
-        cur.execute('insert into project_contact values (%d, %d, %d)' % (pcid, pid, cid))
+        query(cur, 'insert_project_contact', pcid, pid, cid)
         db.commit()
 
     # Process removals
     if 'remove' in request.query:
         pcid = int(request.query.remove)
-        cur.execute('delete from project_contact where id = %d' % pcid)
+        query(cur, 'delete_project_contact', pcid)
         db.commit()
 
     # Show contacts on this project (both colleagues and clients), with links to remove
-    q = 'select pc.id, c.id, c.last_name, c.first_name, c.company, c.title '
-    q += 'from contact as c, project_contact as pc '
-    q += 'where pc.project_id = %d and c.id = pc.contact_id ' % pid
-    q += 'order by c.last_name'
-    cur.execute(q)
+    query(cur, 'project_members', pid)
     pcc = cur.fetchall()
-    already = []
+    already = set()
     s.write('<h3>People on this project</h3>\n')
     if len(pcc) == 0:
         s.write('<p>There are no people on this project</p>\n')
@@ -703,24 +853,29 @@ def project_contacts(pid):
         s.write('<ul>\n')
         for pc in pcc:
             pcid, cid, lname, fname, co, title = pc
-            already.append(cid)
+            already.add(cid)
             s.write('<li>%s %s (%s, %s) <a href="/project_contacts/%d?remove=%d" class="button">Remove</a></li>\n' % (fname, lname, title, co, pid, pcid))
         s.write('</ul>\n')
 
-    # Links to add people not already on project
+    # Find people to add: those not already on the project whose name or
+    # company starts with what is typed (shown as it is typed, or when the
+    # form is sent)
+    q = request.query.q.strip()
+    limit = config['typeahead_limit']
     s.write('<h3>People who can be added to this project</h3>\n')
-    s.write('<p>Click on the button to add a person to the project:</p>\n')
-    q = 'select id, last_name, first_name, company, title '
-    q += 'from contact order by last_name'
-    cur.execute(q)
-    s.write('<ul>\n')
-    for c in cur.fetchall():
-        cid, lname, fname, co, title = c
-        if not cid in already:
-            s.write('<li>%s %s (%s, %s) <a href="/project_contacts/%d?add=%d" class="button">Add</a></li>\n' % (fname, lname, title, co, pid, cid))
+    s.write('<form method="get" action="/project_contacts/%d">\n' % pid)
+    s.write('<p>Name or company: <input type="text" name="q" value="%s" class="field" autocomplete="off" ' % htmlAttr(q))
+    s.write('data-list="found" data-limit="%d" data-href="/project_contacts/%d?add={id}" data-label="Add" ' % (limit, pid))
+    s.write('data-exclude="%s" oninput="contactTypeahead(this)" /> ' % ','.join(str(cid) for cid in sorted(already)))
+    s.write('<input type="submit" class="button" value="Find" /></p>\n</form>\n')
+    s.write('<ul id="found">\n')
+    if q:
+        for c in contactsStartingWith(cur, q, limit + len(already)):
+            cid, lname, fname, co, title = c[:5]
+            if not cid in already:
+                s.write('<li>%s %s (%s, %s) <a href="/project_contacts/%d?add=%d" class="button">Add</a></li>\n' % (fname, lname, title, co, pid, cid))
     s.write('</ul>\n')
-
-    db.close()
+    s.write('<script language="JavaScript" type="text/javascript" src="%s"></script>\n' % assetUrl('contacts.js'))
 
     footer(s)
     return s.getvalue()
@@ -731,7 +886,7 @@ def project_contacts(pid):
 #--------------------------------------------------------------------#
 
 # Save project from editing form
-@route('/calendar')
+@route('/calendar', cache = True)
 def calendar():
 
 
@@ -764,6 +919,7 @@ def calendar():
     s.write('<a href="/calendar?month=%d&year=%d" class="button">&lt;&lt;&nbsp;Previous</a>\n' % (prevMonth, prevYear))
     s.write('<a href="/calendar?month=%d&year=%d" class="button">This month</a>\n' % (tdy.month, tdy.year))
     s.write('<a href="/calendar?month=%d&year=%d" class="button">Next&nbsp;&gt;&gt;</a>\n' % (nextMonth, nextYear))
+    s.write('<a href="/calendar/year/%d" class="button">Year</a>\n' % year)
 
     # Display calendar heading
     s.write('<table width="100%" border="1">\n')
@@ -779,19 +935,18 @@ def calendar():
     #   month = substr(d, 6, 2)
     #   day =   substr(d, 9, 2)
     #   year-month = substr(d, 1, 7)
-    q = "select substr(work_date,9,2), p.id, p.name, sum(w.hours), w.billable"
-    q += " from project as p, work as w"
-    q += " where p.id = w.project_id"
-    q += " and substr(work_date, 1, 7) = '%d-%02d'" % (year, month)
-    q += " group by substr(work_date,9,2), p.id, p.name, w.billable"
-    cur.execute(q)
+    query(cur, 'calendar_month', *monthRange(year, month))
     ww = cur.fetchall()
 
-    # Assign a colour to each project, and remember each colour's name
+    # Assign a colour to each project, and remember each colour's name.
+    # Also put the hours on each project into a bucket for each day,
+    # key is project id, value = hours, and remember which were billable.
     colors = ['#abc', '#cab', '#cba', '#bca', '#acb', '#bac', '#cde', '#dec', '#edc', '#ced', 
             'yellow', 'green', 'red', 'blue', 'cyan', 'magenta', 'olive']
     projCol = {}
     projName = {}
+    dayHrs = {}       # day => {project id => hours}
+    dayBillable = {}  # day => {project id => True}
     cn = 0
     for w in ww:
         day, pid, pname, hrs, billable = w
@@ -804,6 +959,9 @@ def calendar():
             cn += 1
         if not pid in projName:
             projName[pid] = pname
+        dayHrs.setdefault(day, {})[pid] = hrs
+        if billable:
+            dayBillable.setdefault(day, {})[pid] = True
 
     # Get starting day of week
     d = date(year, month, 1)
@@ -825,17 +983,9 @@ def calendar():
             for i in range(dow):
                 td(s, '&nbsp;')
 
-        # Accumulate hours on each project for this day
-        projHrs = {}  # key is project id, value = hours
-        billable = {}
-        for w in ww:
-            d, pid, pname, hrs, b = w
-            d = int(d)
-            pid = int(pid)
-            if d == day:
-                projHrs[pid] = hrs
-                if b:
-                    billable[pid] = True
+        # Hours on each project for this day
+        projHrs = dayHrs.get(day, {})
+        billable = dayBillable.get(day, {})
 
         # s.write(day info
         s.write(' <td>')
@@ -867,6 +1017,87 @@ def calendar():
     return s.getvalue()
 
 
+# Year at a glance: one cell for each day, shaded by the hours worked,
+# in columns by week
+@route('/calendar/year/<year:int>')
+def calendar_year(year):
+
+    # The year must leave room for the dates of the next one
+    if not 1 <= year <= 9998:
+        raise HTTPError(400, 'Year must be 1 to 9998')
+
+    # Connect to database and get cursor
+    db = getDB()
+    cur = db.cursor()
+
+    # Get total and billable hours for each day of the year
+    query(cur, 'calendar_year', '%d-01-01' % year, '%d-01-01' % (year + 1))
+    dayHrs = {}  # "yyyy-mm-dd" => (hours, billable hours)
+    totHrs = totBillable = 0.0
+    for ds, hrs, billable in cur.fetchall():
+        dayHrs[ds] = (hrs, billable)
+        totHrs += hrs
+        totBillable += billable
+
+    # Start page
+    s = io.StringIO()
+    header(s)
+    s.write('<h1>Calendar for %d</h1>\n' % year)
+
+    # Hyperlinks for next/prev year, and back to months
+    tdy = today()
+    s.write('<a href="/calendar/year/%d" class="button">&lt;&lt;&nbsp;Previous</a>\n' % (year - 1))
+    s.write('<a href="/calendar/year/%d" class="button">This year</a>\n' % tdy.year)
+    s.write('<a href="/calendar/year/%d" class="button">Next&nbsp;&gt;&gt;</a>\n' % (year + 1))
+    s.write('<a href="/calendar" class="button">Month</a>\n')
+
+    # Weeks start on Monday, first column is the week with January 1
+    jan1 = date(year, 1, 1)
+    start = jan1 - timedelta(jan1.weekday())
+    nweeks = (date(year, 12, 31) - start).days // 7 + 1
+
+    # Heading with the name of each month above the week it starts in
+    s.write('<table class="heatmap">\n')
+    s.write('<tr>\n<td>&nbsp;</td>\n')
+    for w in range(nweeks):
+        label = '&nbsp;'
+        for i in range(7):
+            d = start + timedelta(7 * w + i)
+            if d.day == 1 and d.year == year:
+                label = mnames[d.month]
+        s.write('<td class="tiny">%s</td>\n' % label)
+    s.write('</tr>\n')
+
+    # One row for each day of the week, one cell for each day
+    for dow in range(7):
+        s.write('<tr>\n<td class="tiny">%s</td>\n' % dnames[dow])
+        for w in range(nweeks):
+            d = start + timedelta(7 * w + dow)
+            if d.year != year:
+                s.write('<td class="empty"></td>')
+                continue
+            hrs, billable = dayHrs.get(fmtDate(d), (0.0, 0.0))
+            s.write('<td style="background: %s" title="%s: %.1f hrs, %.1f billable">' % (heatColor(hrs), formatDate(d), hrs, billable))
+            s.write('<a href="/calendar?month=%d&year=%d">&nbsp;</a></td>' % (d.month, d.year))
+        s.write('\n</tr>\n')
+    s.write('</table>\n')
+
+    # Totals for the year
+    pcnt = totBillable / totHrs * 100.0 if totHrs > 0 else 0.0
+    s.write('<p>Total %.1f hrs, %.1f billable (%.1f%%)</p>\n' % (totHrs, totBillable, pcnt))
+
+    footer(s)
+    return s.getvalue()
+
+
+# Colour of a day in the year calendar, darker for more hours
+def heatColor(hrs):
+    colors = ['#eee', '#cec', '#9d9', '#6b6', '#393']
+    if hrs <= 0:
+        return colors[0]
+    return colors[min(int(hrs / 2.0) + 1, 4)]
+
+
 #--------------------------------------------------------------------#
 #                             CONTACTS                               #
 #--------------------------------------------------------------------#
@@ -886,6 +1117,15 @@ def contacts():
     s.write('<h1>Contacts</h1>\n')
     s.write('<p><a href="/edit_contact/0" class="button">Add contact</a></p>\n')
 
+    # Find contacts by the start of their name or company, as it is typed
+    q = request.query.q.strip()
+    s.write('<form method="get" action="/contacts">\n')
+    s.write('<p>Find: <input type="text" name="q" value="%s" class="field" autocomplete="off" ' % htmlAttr(q))
+    s.write('data-list="found" data-limit="%d" data-href="/contact/{id}" ' % config['typeahead_limit'])
+    s.write('oninput="contactTypeahead(this)" /> <input type="submit" class="button" value="Find" /></p>\n</form>\n')
+    s.write('<ul id="found"></ul>\n')
+    s.write('<script language="JavaScript" type="text/javascript" src="%s"></script>\n' % assetUrl('contacts.js'))
+
     # Start table
     s.write('<table width="100%" border="1">\n')
     s.write('  <tr class="heading">\n')
@@ -893,31 +1133,73 @@ def contacts():
         s.write('    <th>%s</th>\n' % h)
     s.write('  </tr>\n')
 
-    # Get contacts and show in table
-    count = 0
-    cur.execute('select id, last_name, first_name, company, title, phones, address, active from contact order by last_name')
-    for c in cur.fetchall():
+    # Get a page of contacts, those found or those after the last one on the
+    # previous page, and show in table
+    n = config['contacts_page_size']
+    if q:
+        cc = contactsStartingWith(cur, q, n + 1)
+    else:
+        try:
+            aid = int(request.query.id or 0)
+        except ValueError:
+            aid = 0
+        cc = query(cur, 'contacts_page', request.query.after, aid, n + 1).fetchall()
+    more = len(cc) > n
+    rows = []
+    for c in cc[:n]:
 
         cid, lname, fname, company, title, phones, address, active = c
-        count += 1
 
         style = 'vertical_align: top'
         if not active:
             style += '; color: #888; background: #ccc'
-        s.write('<tr style="%s">\n' % style)
+        rows.append((None, (style, cid, fname, lname, company, title,
+            phones.replace('\n', '<br/>'), address.replace('\n', '<br/>'))))
+    s.write(renderRows(contactRow, rows))
 
-        td(s, '<a href="/contact/%d">%s %s</a>' % (cid, fname, lname))
-        td(s, '%s<br/>%s' % (company, title))
-        td(s, phones.replace('\n', '<br/>'))
-        td(s, address.replace('\n', '<br/>'))
-
-    # Finish table and page
+    # Finish table, with link to the next page
     s.write('</table>\n')
-    s.write('<p>%d contacts</p>\n' % count)
+    s.write('<p>%d contacts %s' % (len(rows), 'found' if q else 'on this page'))
+    if more and q:
+        s.write(', more start with "%s"' % htmlText(q))
+    elif more:
+        s.write(', <a href="/contacts?%s">next &gt;&gt;</a>' % urlencode({'after': cc[n - 1][1] or '', 'id': cc[n - 1][0]}))
+    s.write('</p>\n')
     footer(s)
     return(s.getvalue())
 
 
+# Typeahead: contacts whose last name, first name or company starts with q,
+# at most limit of them, as JSON. Not kept in the page cache: each prefix
+# typed would be a new page, and the prefix indexes make it cheap anyway.
+@route('/contacts.json')
+def contacts_json():
+    try:
+        limit = min(int(request.query.limit or config['typeahead_limit']), 100)
+    except ValueError:
+        limit = config['typeahead_limit']
+    q = request.query.q.strip()
+    cc = contactsStartingWith(getDB().cursor(), q, limit)
+    return {'q': q, 'contacts': [{'id': cid, 'last_name': lname, 'first_name': fname, 'company': co,
+        'title': title, 'active': isTrue(active)} for cid, lname, fname, co, title, phones, address, active in cc]}
+
+
+# Contacts whose last name, first name or company starts with a prefix,
+# ignoring case, by name, at most limit of them. Each of these has an index
+# ignoring case, so only the contacts found are read, however many there are.
+def contactsStartingWith(cur, prefix, limit):
+    p = prefix.strip().lower()
+    if not p:
+        return []
+    end = p[:-1] + chr(ord(p[-1]) + 1)   # first string after all those starting with p
+    return query(cur, 'contact_prefix', p, end, limit).fetchall()
+
+
+# Row template for the list of contacts
+contactRow = {None: '<tr style="%s">\n'
+    '<td><a href="/contact/%d">%s %s</a></td><td>%s<br/>%s</td><td>%s</td><td>%s</td>'}
+
+
 # Show info for one contact
 @route('/contact/<cid:int>')
 def contact(cid):
@@ -930,7 +1212,7 @@ def contact(cid):
     # Get the contact to show, exit if not found
     db = getDB()
     cur = db.cursor()
-    cur.execute('select id, last_name, first_name, company, title, phones, address, comments, active from contact where id = %d' % cid)
+    query(cur, 'contact', cid)
     c = cur.fetchone()
     if not c:
         s.write('<p>Contact id %d not found</p>' % cid)
@@ -954,11 +1236,7 @@ def contact(cid):
 
     # Show projects for this contact
     s.write('<h2>Projects for this contact</h2>\n')
-    q = 'select p.id, p.client, p.name, p.active '
-    q += 'from project as p, project_contact as pc '
-    q += 'where pc.contact_id = %d and p.id = pc.project_id ' % cid
-    q += 'order by p.name'
-    cur.execute(q)
+    query(cur, 'contact_projects', cid)
     pcp = cur.fetchall()
     already = []
     if len(pcp) == 0:
@@ -997,7 +1275,7 @@ def edit_contact(cid):
     # CREATE TABLE contact (id integer NOT NULL, last_name character(32), first_name character(32), 
     # company character(32), title character(32), phones text, address text, comments text, active boolean);
     if cid > 0:
-        cur.execute('select id, last_name, first_name, company, title, phones, address, comments, active from contact where id = %d' % cid)
+        query(cur, 'contact', cid)
         cid, lname, fname, company, title, phones, address, comments, active = cur.fetchone()
         active = isTrue(active)
     else:
@@ -1022,8 +1300,6 @@ def edit_contact(cid):
     s.write('<input type="submit" value="Save" class="button">')
     s.write('</form>')
 
-    db.close()
-
     footer(s)
     return s.getvalue()
 
@@ -1053,19 +1329,169 @@ def save_contact():
         db = getDB()
         cur = db.cursor()
         if cid > 0:
-            q = "update contact set last_name = '%s', first_name = '%s', company = '%s', title = '%s', phones = '%s', address = '%s', comments = '%s', active = %d  where id = %d" % (lname, fname, company, title, phones, address, comments, active, cid)
+            query(cur, 'update_contact', lname, fname, company, title, phones, address, comments, active, cid)
         else:
             cid = nextId('contact', cur)
-            q = "insert into contact values (%d, '%s', '%s', '%s', '%s', '%s', '%s', '%s', %d)" % (cid, lname, fname, company, title, phones, address, comments, active)
-        cur.execute(q)
+            query(cur, 'insert_contact', cid, lname, fname, company, title, phones, address, comments, active)
         db.commit()
-        db.close()
         redirect('/contact/%d' % cid)
 
     footer(s)
     return s.getvalue()
 
 
+#--------------------------------------------------------------------#
+#                              SEARCH                                #
+#--------------------------------------------------------------------#
+
+# Page to show each kind of search result
+searchLinks = {'work': '/edit_log/%d', 'project': '/project/%d', 'contact': '/contact/%d'}
+
+
+# Search work entries, projects and contacts for the words in q, show a page
+# of results, best first, with the words found in bold; or give them as JSON
+@route('/search', cache = True)
+@route('/search.json', cache = True)
+def search_page():
+
+    # Search for the words given
+    q = request.query.q.strip()
+    try:
+        page = max(1, int(request.query.page or 1))
+    except ValueError:
+        page = 1
+    db = getDB()
+    cur = db.cursor()
+    results, more, capped = search(cur, q, page)
+
+    # Results as JSON
+    if request.path.endswith('.json'):
+        return {'q': q, 'page': page, 'more': more, 'capped': capped, 'results': [{'kind': kind, 'id': ref,
+            'date': ds, 'url': searchLinks[kind] % ref, 'title': searchHTML(title),
+            'snippet': searchHTML(snippet)} for kind, ref, ds, title, snippet in results]}
+
+    # Start page, with search form
+    s = io.StringIO()
+    header(s, 'search')
+    s.write('<h1>Search</h1>\n')
+    s.write('<form method="get" action="/search">\n')
+    s.write('<p><input type="text" name="q" value="%s" class="field" style="width: 400px" /> ' % htmlAttr(q))
+    s.write('<input type="submit" class="button" value="Search" /></p>\n')
+    s.write('</form>\n')
+
+    # Results, saying if only the most recent matches of some kind are shown
+    if q and not results:
+        s.write('<p>Nothing found</p>\n')
+    if capped:
+        s.write('<p><i>Showing only the most recent %d matching %s; add words to narrow the search.</i></p>\n'
+            % (config['search_rank_limit'], ' and '.join(searchPlurals[kind] for kind in capped)))
+    for kind, ref, ds, title, snippet in results:
+        s.write('<p><a href="%s">%s</a> %s (%s)' % (searchLinks[kind] % ref, searchHTML(title),
+            formatDate(parseDate(ds)) if ds else '', kind))
+        if snippet:
+            s.write('<br/>\n%s' % searchHTML(snippet))
+        s.write('</p>\n')
+
+    # Links to other pages of results
+    if page > 1 or more:
+        s.write('<p>')
+        if page > 1:
+            s.write('<a href="/search?%s">&lt;&lt; previous</a> ' % urlencode({'q': q, 'page': page - 1}))
+        s.write('page %d' % page)
+        if more:
+            s.write(' <a href="/search?%s">next &gt;&gt;</a>' % urlencode({'q': q, 'page': page + 1}))
+        s.write('</p>\n')
+
+    # Finish page
+    footer(s)
+    return s.getvalue()
+
+
+# Search query for FTS5 from the words typed, all of which must match. A
+# word ending in * matches words starting with it. Anything else is ignored,
+# so the query is always valid.
+def ftsQuery(q):
+    return ' '.join('"%s"%s' % (w, star) for w, star in re.findall(r'(\w+)(\*?)', q))
+
+
+# Names of the kinds of records, for saying which were too many to rank
+searchPlurals = {'work': 'work entries', 'project': 'projects', 'contact': 'contacts'}
+
+
+# Search the index, return a page of results as (kind, ID, date, title,
+# snippet), whether there are more, and the kinds of records with more
+# matches than were ranked. Each kind is searched on its own, and only its
+# most recent search_rank_limit matches (by rowid, i.e., ID) are ranked, so
+# searches for common words take no longer than those for rare ones, and
+# many matching work entries don't hide the projects and contacts.
+def search(cur, q, page = 1):
+    words = ftsQuery(q)
+    if not words:
+        return [], False, []
+    rows = []
+    capped = []
+    for kind, (k, date, title, body, cols) in searchSources.items():
+        match = 'tag:kind%d AND {title body}: (%s)' % (k, words)
+        r = query(cur, 'search_cutoff', match, config['search_rank_limit']).fetchone()
+        if r:
+            capped.append(kind)
+        rows += query(cur, 'search', match, r[0] if r else -1).fetchall()
+    rows = rankResults(rows)
+    n = config['search_page_size']
+    results = [(kind, ref, ds, title, snippet(text)) for kind, ref, ds, title, text in rows[(page - 1) * n:page * n]]
+    return results, len(rows) > page * n, capped
+
+
+# The words found by a search, as marked by highlight() in the 'search' query
+searchMarks = re.compile('\x02(.*?)\x03')
+
+
+# Rank search results, given as (kind, ID, date, title, text) with the words
+# found between \x02 and \x03, best first, by BM25 with words in the title
+# counting double; equally good ones stay in the order given. FTS5's bm25()
+# would count every row of the index containing each word to weight the
+# words, which takes 100 ms for a word in a million rows, so the words are
+# weighted by how many of these results contain them instead.
+def rankResults(rows, k1 = 1.2, b = 0.75):
+    docs = []  # (word => weighted count, number of words)
+    for kind, ref, ds, title, text in rows:
+        tf = {}
+        for s, weight in [(title, 2.0), (text, 1.0)]:
+            for w in searchMarks.findall(s):
+                w = w.lower()
+                tf[w] = tf.get(w, 0.0) + weight
+        docs.append((tf, len(title.split()) + len(text.split())))
+    if not docs:
+        return rows
+
+    # Inverse document frequency of each word, average length
+    df = {}
+    for tf, n in docs:
+        for w in tf:
+            df[w] = df.get(w, 0) + 1
+    idf = dict((w, math.log(1 + (len(docs) - c + 0.5) / (c + 0.5))) for w, c in df.items())
+    avg = sum(n for tf, n in docs) / len(docs) or 1.0
+
+    scores = [sum(idf[w] * f * (k1 + 1) / (f + k1 * (1 - b + b * n / avg)) for w, f in tf.items())
+        for tf, n in docs]
+    return [rows[i] for i in sorted(range(len(rows)), key = lambda i: -scores[i])]
+
+
+# Snippet of a text from the search index: about n words, starting a little
+# before the first word found
+def snippet(text, n = 16):
+    words = text.split()
+    i = next((i for i, w in enumerate(words) if '\x02' in w), 0)
+    start = max(0, min(i - n // 4, len(words) - n))
+    s = ' '.join(words[start:start + n])
+    return ('...' if start > 0 else '') + s + ('...' if start + n < len(words) else '')
+
+
+# HTML for text from the search index, with the words found in bold
+def searchHTML(s):
+    return htmlText(s or '').replace('\x02', '<b>').replace('\x03', '</b>')
+
+
 #--------------------------------------------------------------------#
 #                            REPORTS                                 #
 #--------------------------------------------------------------------#
@@ -1091,7 +1517,7 @@ def reports():
 
 
 # Weekly & Monthly utilization report
-@route('/utilization')
+@route('/utilization', cache = True)
 def utilization():
 
     # Connect to database
@@ -1104,45 +1530,12 @@ def utilization():
     s.write('<div style="padding: 32px">\n')
     s.write('<h1>Utilization Report</h1>\n')
 
-    # Get the time log records for the current year
-    # PROBLEM: the counters will be out or missed, if there are gaps in the dates
-    q = 'select work.id, project_id, client, name, work_date, hours, work.billable, work.description '
-    q += ' from work, project where work.project_id = project.id'
-    q += " and substr(work_date,1,7) >= '%s'" % this_month
-    q += ' order by work_date'  # desc limit 400'
-    cur.execute(q)
-    work = cur.fetchall()
-
-    # Initialize counters
-    dHrs = {}
-    dBillable = {}
-    wHrs = {}
-    wBillable = {} 
-    mHrs =  {}
-    mBillable = {} 
-
-    # Do counters, by week and month
-    for w in work:
-
-        wid, pid, client, projName, wdate, hrs, billable, descr = w
-        wdate = parseDate(wdate)
-
-        # Ignore rows for some projects
-        if pid in ignoreProjectIDs:
-            continue
-
-        # Get keys for week/month
-        wkey = wdate - timedelta(wdate.weekday())   # Monday of this week
-        mkey = date(wdate.year, wdate.month, 1)     # Beginning of month
-
-        # Update counters
-        dHrs[wdate] = dHrs.get(wdate, 0) + hrs
-        wHrs[wkey] = wHrs.get(wkey, 0) + hrs
-        mHrs[mkey] = mHrs.get(mkey, 0) + hrs
-        if billable:
-            dBillable[wdate] = dBillable.get(wdate, 0) + hrs
-            wBillable[wkey] = wBillable.get(wkey, 0) + hrs
-            mBillable[mkey] = mBillable.get(mkey, 0) + hrs
+    # Get total and billable hours by week and month from the rollup tables,
+    # starting with the whole week that contains the first day of the log
+    start = logStart()
+    d0 = parseDate(start)
+    wHrs, wBillable = rollupTotals(cur, 'work_weekly', fmtDate(d0 - timedelta(d0.weekday())))
+    mHrs, mBillable = rollupTotals(cur, 'work_monthly', start)
 
     # Show in a table (for now, graph to do)
     s.write('<h2>Weekly Utilization</h2>\n')
@@ -1167,8 +1560,21 @@ def utilization():
     return s.getvalue()
 
 
-@route('/monthly_report')
-@route('/monthly_report/<yyyymm>')
+# Get total and billable hours for each period of a rollup table, from the
+# given start date, ignoring some projects, as two dictionaries keyed by the
+# period's "yyyy-mm-dd" start date
+def rollupTotals(cur, table, start):
+    cur.execute(totalsQuery(table, len(ignoreProjectIDs)), [start] + ignoreProjectIDs)
+    hrs = {}
+    billable = {}
+    for period, h, b in cur.fetchall():
+        hrs[period] = h
+        billable[period] = b
+    return hrs, billable
+
+
+@route('/monthly_report', cache = True)
+@route('/monthly_report/<yyyymm>', cache = True)
 def monthly_report(yyyymm = None):
 
     # Connect to database
@@ -1207,12 +1613,7 @@ def monthly_report(yyyymm = None):
 
     # Get hours by project for that month
     # TODO: billable vs. non-billable
-    q = 'select p.client, p.name, sum(w.hours)'
-    q += ' from work as w, project as p'
-    q += ' where w.project_id = p.id'
-    q += " and substr(w.work_date,1,7) = '%d-%02d'" % (y, m)
-    q += ' group by p.client, p.name order by client'
-    cur.execute(q)
+    query(cur, 'monthly_report', monthRange(y, m)[0])
 
     # Start table
     s.write('<table>\n')
@@ -1250,8 +1651,8 @@ def monthly_report(yyyymm = None):
 
 
 # Timesheet report, hours on each project for a week Mon-Sun
-@route('/timesheet')
-@route('/timesheet/<yyyymmdd>')
+@route('/timesheet', cache = True)
+@route('/timesheet/<yyyymmdd>', cache = True)
 def timesheet(yyyymmdd = None):
 
     # Connect to database
@@ -1263,12 +1664,7 @@ def timesheet(yyyymmdd = None):
     header(s, 'reports')
 
     # Get starting date for week, either from URL or this week
-    if yyyymmdd == None or yyyymmdd == 'this':
-        d = today()
-    else:
-        d = parseDate(yyyymmdd)
-    if d.weekday() > 0:
-        d -= timedelta(d.weekday())  # Monday of week
+    d = weekStart(yyyymmdd)
 
     # Heading with selected week, links to next/prev week
     s.write('<div style="padding: 32px">\n')
@@ -1277,15 +1673,10 @@ def timesheet(yyyymmdd = None):
     s.write('<a href="/timesheet/%s">&lt;&lt; previous</a> ' % fmtDate(d - timedelta(7)))
     s.write('/ <a href="/timesheet/this">this</a> ')
     s.write('/ <a href="/timesheet/%s">next &gt;&gt;</a> week</p>' % fmtDate(d + timedelta(7)))
+    s.write('<p><a href="/timesheet/%s/edit" class="button">Edit</a></p>\n' % fmtDate(d))
 
     # Get daily hours by project for that week
-    q = 'select p.client, p.name, w.work_date, sum(w.hours)'
-    q += ' from work as w, project as p'
-    q += ' where w.project_id = p.id'
-    q += " and w.work_date >= '%s'" % fmtDate(d)
-    q += " and w.work_date <= '%s'" % fmtDate(d + timedelta(6))
-    q += ' group by p.client, p.name, w.work_date order by p.client, p.name, w.work_date'
-    cur.execute(q)
+    query(cur, 'timesheet', fmtDate(d), fmtDate(d + timedelta(6)))
 
     # Turn it into a dictionary
     work = {}  # proj => { date => hrs }
@@ -1346,19 +1737,207 @@ def timesheet(yyyymmdd = None):
     return s.getvalue()
 
 
-# Stacked area graph of daily/weekly time on projects
-@route('/project_graph')
-def project_graph():
+# Monday of the week of a "yyyymmdd" or "yyyy-mm-dd" date, or of this week
+def weekStart(yyyymmdd):
+    if yyyymmdd == None or yyyymmdd == 'this':
+        d = today()
+    else:
+        d = parseDate(yyyymmdd) or parseDate('%s-%s-%s' % (yyyymmdd[:4], yyyymmdd[4:6], yyyymmdd[6:]))
+        if not d:
+            raise HTTPError(404, 'Invalid date %s' % yyyymmdd)
+    return d - timedelta(d.weekday())
+
+
+# Hours of the work entries of a week, as a dictionary (project ID, "yyyy-mm-dd")
+# => list of (entry ID, hours)
+def weekEntries(cur, d):
+    entries = {}
+    for wid, pid, ds, hrs in query(cur, 'week_work', fmtDate(d), fmtDate(d + timedelta(6))).fetchall():
+        entries.setdefault((pid, ds), []).append((wid, hrs))
+    return entries
+
+
+# Editable timesheet: a grid of hours for each project (active ones, and
+# those with entries that week) and day, saved all at once. A cell with more
+# than one entry can't be changed here, as it's not clear which one to
+# change; edit those entries in the history instead. Each field comes with
+# the hours it had, so only the cells changed in the form are saved.
+@route('/timesheet/<yyyymmdd>/edit', etag = False)
+def edit_timesheet(yyyymmdd):
 
     # Connect to database
     db = getDB()
     cur = db.cursor()
+    d = weekStart(yyyymmdd)
+    days = [fmtDate(d + timedelta(di)) for di in range(7)]
+    entries = weekEntries(cur, d)
 
-    # Start page
+    # Start page and form
     s = io.StringIO()
     header(s, 'reports')
     s.write('<div style="padding: 32px">\n')
-    s.write('<h1>Project Activity Graph</h1>\n')
+    s.write('<h1>Edit Timesheet for %s</h1>\n' % fmtDate(d))
+    s.write('<form method="post" action="/save_timesheet">\n')
+    s.write('<input type="hidden" name="week" value="%s" />\n' % fmtDate(d))
+    s.write('<table>\n')
+    s.write('<tr>\n')
+    for h in ['Client', 'Project']:
+        s.write('  <th>%s</th>\n' % h)
+    for ds in days:
+        dt = parseDate(ds)
+        s.write('  <th style="text-align: right">%s %02d/%02d</th>\n' % (dnames[dt.weekday()], dt.day, dt.month))
+    s.write('</tr>\n')
+
+    # One row of fields for each project
+    for pid, client, name, billable in query(cur, 'timesheet_projects', days[0], days[-1]).fetchall():
+        s.write('<tr>\n')
+        s.write('  <td>%s</td><td>%s</td>\n' % (client, name))
+        for ds in days:
+            e = entries.get((pid, ds), [])
+            hrs = sum(h for wid, h in e)
+            value = '%.2f' % hrs if e else ''
+            if len(e) > 1:
+                s.write('  <td align="right" title="%d entries">%s</td>\n' % (len(e), value))
+            else:
+                s.write('  <td><input type="text" name="h_%d_%s" value="%s" class="field" '
+                    'style="width: 4em; text-align: right; font-family: monospace" />'
+                    '<input type="hidden" name="o_%d_%s" value="%s" /></td>\n' % (pid, ds, value, pid, ds, value))
+        s.write('</tr>\n')
+
+    # Buttons, finish form and page
+    s.write('</table>\n')
+    s.write('<p><input type="submit" class="button" style="color: white; background-color: #0c0;" value="Save" /> ')
+    s.write('<a href="/timesheet/%s" class="button">Cancel</a></p>\n' % fmtDate(d))
+    s.write('</form>\n')
+    s.write('</div>\n')
+    footer(s)
+    return s.getvalue()
+
+
+# Save the timesheet grid: for each cell changed in the form, insert, update
+# or delete the entry for that project and day to match, all in one
+# transaction. Cells whose entries were changed elsewhere since the form was
+# shown are not saved, and are listed instead.
+@post('/save_timesheet')
+def save_timesheet():
+
+    # Get the hours from the form, and the hours each cell had, check them
+    d = weekStart(request.forms.week)
+    days = [fmtDate(d + timedelta(di)) for di in range(7)]
+    cells = {}   # (project ID, "yyyy-mm-dd") => (hours shown, hours)
+    errs = []
+    for k in request.forms.keys():
+        if not k.startswith('h_'):
+            continue
+        try:
+            _, pid, ds = k.split('_')
+            pid = int(pid)
+        except ValueError:
+            continue
+        v = request.forms.get(k).strip()
+        try:
+            hrs = float(v) if v else 0.0
+        except ValueError:
+            errs.append('Hours for %s must be a number, not "%s"' % (ds, v))
+            continue
+        try:
+            o = request.forms.get('o_%d_%s' % (pid, ds))
+            shown = round(float(o), 2) if o else None
+        except (TypeError, ValueError):
+            continue   # no hours shown for this cell, leave it alone
+        if hrs < 0 or hrs > 24:
+            errs.append('Hours for %s must be 0 to 24' % ds)
+        elif ds in days:
+            cells[(pid, ds)] = (shown, round(hrs, 2))
+
+    # Save changes in one transaction
+    if not errs:
+        db = getDB()
+        cur = db.cursor()
+        if not db.in_transaction:
+            cur.execute('begin immediate')   # the entries don't change before we save
+        try:
+            inserted, updated, deleted, conflicts = saveTimesheet(cur, d, cells)
+            db.commit()
+        except:
+            db.rollback()
+            raise
+        if not conflicts:
+            redirect('/timesheet/%s' % fmtDate(d))
+
+        # Show the cells that were not saved
+        s = io.StringIO()
+        header(s, 'reports')
+        s.write('<div style="padding: 32px">\n')
+        s.write('<h1>%d Cells Not Saved</h1>\n' % len(conflicts))
+        s.write('<p>These entries were changed by someone else after the timesheet was opened, '
+            'so your hours for them were not saved:</p>\n<ul>\n')
+        for client, name, ds in conflicts:
+            s.write(' <li>%s %s on %s</li>\n' % (htmlText(client), htmlText(name), ds))
+        s.write('</ul>\n<p>The other changes (%d entries added, %d changed, %d deleted) were saved. '
+            '<a href="/timesheet/%s/edit">Edit the timesheet again</a></p>\n'
+            % (inserted, updated, deleted, fmtDate(d)))
+        s.write('</div>\n')
+        footer(s)
+        return s.getvalue()
+
+    # Show validation errors
+    s = io.StringIO()
+    header(s, 'reports')
+    s.write('<h1>%d Errors Editing Timesheet</h1>\n<ul>\n' % len(errs))
+    for e in errs:
+        s.write(' <li>%s</li>\n' % htmlText(e))
+    s.write('</ul>\n<p>Click back button to fix errors.</p>\n')
+    footer(s)
+    return s.getvalue()
+
+
+# Insert, update and delete the entries of the week starting on d so that
+# they match the hours in cells, a dictionary (project ID, "yyyy-mm-dd") =>
+# (hours shown in the form, or None if empty; hours). Only changed cells are
+# saved, and only if their entry still has the hours shown; other cells are
+# returned as conflicts. New entries are billable if their project is.
+# Returns the number of entries inserted, updated and deleted, and the
+# conflicts as a list of (client, project name, "yyyy-mm-dd").
+def saveTimesheet(cur, d, cells):
+    entries = weekEntries(cur, d)
+    billable = {}
+    names = {}
+    for pid, client, name, b in query(cur, 'project_names').fetchall():
+        billable[pid] = 1 if isTrue(b) else 0
+        names[pid] = (client, name)
+
+    inserts, updates, deletes, conflicts = [], [], [], []
+    wid = None
+    for (pid, ds), (shown, hrs) in sorted(cells.items()):
+        if hrs == (shown or 0) or pid not in billable:
+            continue
+        e = entries.get((pid, ds), [])
+        if shown is None:
+            changed = len(e) > 0
+        else:
+            changed = len(e) != 1 or round(e[0][1], 2) != shown
+        if changed:
+            conflicts.append(names[pid] + (ds,))
+            continue
+        if e and hrs == 0:
+            deletes.append((e[0][0],))
+        elif e and round(e[0][1], 2) != hrs:
+            updates.append((hrs, e[0][0]))
+        elif not e and hrs > 0:
+            wid = wid or nextId('work', cur)
+            inserts.append((wid, pid, ds, hrs, billable[pid], ''))
+            wid += 1
+
+    queryMany(cur, 'insert_work', inserts)
+    queryMany(cur, 'update_work_hours', updates)
+    queryMany(cur, 'delete_work', deletes)
+    return len(inserts), len(updates), len(deletes), conflicts
+
+
+# Stacked area graph of daily/weekly time on projects
+@route('/project_graph', etag = False)
+def project_graph():
 
     # Use sessions to remember settings, e.g., stacking
     sess = get_session()
@@ -1384,6 +1963,24 @@ def project_graph():
     # Save settings in session
     save_session(sess)
 
+    # The page only depends on the settings and the data
+    return responses.get(('project_graph', do_stack, period),
+            lambda: projectGraph(do_stack, period))
+
+
+# Build the project graph page, with the given settings
+def projectGraph(do_stack, period):
+
+    # Connect to database
+    db = getDB()
+    cur = db.cursor()
+
+    # Start page
+    s = io.StringIO()
+    header(s, 'reports')
+    s.write('<div style="padding: 32px">\n')
+    s.write('<h1>Project Activity Graph</h1>\n')
+
     # Allow changing stacking
     s.write('<p>Stacking: ')
     if do_stack == 1:
@@ -1402,10 +1999,6 @@ def project_graph():
     s.write('</p>\n')
 
     # Get daily hours by project, only up to today
-    # TODO: date range
-    q = 'select w.work_date, p.client, p.name, w.hours'
-    q += ' from work as w, project as p'
-    q += ' where w.project_id = p.id'
     until = today()
     if period == '30d':
         d0 = today() - timedelta(30)
@@ -1417,10 +2010,7 @@ def project_graph():
         d0 = today() - timedelta(365)
     else:
         d0 = None   # All dates
-    if d0:
-        q += " and w.work_date >= '%s'" % fmtDate(d0)
-    q += " and w.work_date <= '%s'" % fmtDate(until)
-    cur.execute(q)
+    query(cur, 'project_graph', fmtDate(d0) if d0 else '', fmtDate(until))
 
     # Group by week or month
     ghrs = {}  # Key = project, value = {period: hours}
@@ -1461,8 +2051,8 @@ def project_graph():
     s.write('</script>\n')
 
     # Embed script tags for D3 and the graph
-    s.write('<script language="JavaScript" type="text/javascript" src="/static/d3.min.js"></script>\n')
-    s.write('<script language="JavaScript" type="text/javascript" src="/static/script.js"></script>\n')
+    s.write('<script language="JavaScript" type="text/javascript" src="%s"></script>\n' % assetUrl('d3.min.js'))
+    s.write('<script language="JavaScript" type="text/javascript" src="%s"></script>\n' % assetUrl('script.js'))
 
     # Finish page
     s.write('</div>\n')
@@ -1470,24 +2060,539 @@ def project_graph():
     return s.getvalue()
 
 
+#--------------------------------------------------------------------#
+#                        IMPORT AND EXPORT                           #
+#--------------------------------------------------------------------#
+
+# Columns of a file of work entries to import. The project is given either
+# by project_id, or by client and project name (ignoring case). If billable
+# is left out, the project's setting is used.
+importColumns = ['date', 'client', 'project', 'project_id', 'hours', 'billable', 'description']
+
+
+# Form to upload a CSV or JSON file of work entries
+@route('/import', etag = False)
+def import_form():
+    s = io.StringIO()
+    header(s, 'import')
+    s.write('<h1>Import Work Entries</h1>\n')
+    s.write('<p>A CSV file with a heading row, or a JSON list of objects, with the columns ')
+    s.write('%s. Dates are yyyy-mm-dd; the project is given by its ID, ' % ', '.join(importColumns))
+    s.write('or by client and project name.</p>\n')
+    s.write('<form method="post" action="/import" enctype="multipart/form-data">\n')
+    s.write('<p><input type="file" name="file" accept=".csv,.json" /></p>\n')
+    s.write('<p><input type="submit" class="button" value="Import" /></p>\n')
+    s.write('</form>\n')
+
+    # Links to export each table, and a form to export some work entries
+    s.write('<h1>Export</h1>\n<ul>\n')
+    for t in exportColumns:
+        s.write('<li>%s: <a href="/export/%s.csv">CSV</a> / <a href="/export/%s.json">JSON</a></li>\n'
+            % (t.title(), t, t))
+    s.write('</ul>\n')
+    s.write('<form method="get" action="/export/work.csv">\n<p>Work entries from ')
+    s.write('<input type="text" name="from" placeholder="yyyy-mm-dd" class="field" /> to ')
+    s.write('<input type="text" name="to" placeholder="yyyy-mm-dd" class="field" /> for project ID ')
+    s.write('<input type="text" name="project" class="field" /> ')
+    s.write('<input type="submit" class="button" value="Export CSV" /></p>\n</form>\n')
+    footer(s)
+    return s.getvalue()
+
+
+# Import work entries, either a file uploaded with the form, or the body of
+# the request (CSV, or JSON if the content type says so). Answers with the
+# import report as JSON, or as a page for the form.
+@post('/import')
+def import_work():
+    upload = request.files.get('file')
+    if upload:
+        fmt = 'json' if upload.raw_filename.lower().endswith('.json') else 'csv'
+        f = upload.file
+    else:
+        fmt = 'json' if 'json' in request.content_type else 'csv'
+        f = request.body
+    try:
+        rows = readImport(io.TextIOWrapper(f, encoding = 'utf-8-sig', newline = ''), fmt)
+        report = importWork(getDB(), rows)
+    except (ValueError, csv.Error) as e:
+        raise HTTPError(400, 'Cannot read %s: %s' % (fmt.upper(), e))
+    if not upload or 'json' in request.headers.get('Accept', ''):
+        return report
+
+    # Show the report
+    s = io.StringIO()
+    header(s, 'import')
+    s.write('<h1>Import Work Entries</h1>\n')
+    s.write('<p>Imported %d of %d rows in %.3f sec (%.0f rows/sec)</p>\n' % (report['imported'],
+        report['rows'], report['seconds'], report['rows_per_sec']))
+    if report['rejects']:
+        s.write('<h3>%d rows rejected</h3>\n<ul>\n' % report['rejected'])
+        for n, reason in report['rejects']:
+            s.write('<li>Row %d: %s</li>\n' % (n, htmlText(reason)))
+        s.write('</ul>\n')
+    footer(s)
+    return s.getvalue()
+
+
+# Read the rows of a CSV file with a heading row, or of a JSON list of
+# objects, as dictionaries
+def readImport(f, fmt):
+    if fmt == 'json':
+        rows = json.load(f)
+        if type(rows) is not list or not all(type(r) is dict for r in rows):
+            raise ValueError('expected a list of objects')
+        return rows
+    return csv.DictReader(f)
+
+
+# Import work entries, given as dictionaries with the importColumns. Rows
+# that are not valid are rejected, the others are given consecutive IDs and
+# inserted all at once, in one transaction. Returns a report with the number
+# of rows read, imported and rejected, rows per second, and the first
+# rejects as (row number, reason).
+def importWork(db, rows, maxRejects = 100):
+    t = time.perf_counter()
+    cur = db.cursor()
+    if not db.in_transaction:
+        cur.execute('begin immediate')   # nobody else adds entries meanwhile
+    try:
+
+        # Projects by ID and by client and name
+        projects = {}
+        names = {}
+        for pid, client, name, billable in query(cur, 'project_names').fetchall():
+            projects[pid] = billable
+            names[((client or '').strip().lower(), (name or '').strip().lower())] = pid
+
+        # Check each row and convert it to a row of the work table
+        wid = nextId('work', cur)
+        work = []
+        rejects = []
+        n = 0
+        for r in rows:
+            n += 1
+            try:
+                w = importRow(r, projects, names)
+            except ValueError as e:
+                rejects.append((n, str(e)))
+                continue
+            work.append((wid,) + w)
+            wid += 1
+
+        queryMany(cur, 'insert_work', work)
+        db.commit()
+    except:
+        db.rollback()
+        raise
+
+    t = time.perf_counter() - t
+    return {'rows': n, 'imported': len(work), 'rejected': len(rejects),
+            'rejects': rejects[:maxRejects], 'seconds': round(t, 3),
+            'rows_per_sec': round(n / t, 1) if t > 0 else 0.0}
+
+
+# Check one row to import, return (project_id, work_date, hours, billable,
+# description), or raise ValueError with the reason
+def importRow(r, projects, names):
+    v = lambda k: str(r.get(k) if r.get(k) is not None else '').strip()
+
+    d = parseDate(v('date'))
+    if not d:
+        raise ValueError('date "%s" is not yyyy-mm-dd' % v('date'))
+
+    try:
+        hours = float(v('hours'))
+    except ValueError:
+        raise ValueError('hours "%s" is not a number' % v('hours'))
+    if not 0 < hours <= 24:
+        raise ValueError('hours %s is not between 0 and 24' % v('hours'))
+
+    if v('project_id'):
+        try:
+            pid = int(v('project_id'))
+        except ValueError:
+            raise ValueError('project_id "%s" is not a number' % v('project_id'))
+        if pid not in projects:
+            raise ValueError('no project with ID %d' % pid)
+    else:
+        pid = names.get((v('client').lower(), v('project').lower()))
+        if pid is None:
+            raise ValueError('no project "%s" for client "%s"' % (v('project'), v('client')))
+
+    billable = (1 if isTrue(v('billable')) else 0) if v('billable') else (1 if isTrue(projects[pid]) else 0)
+    return (pid, fmtDate(d), hours, billable, v('description'))
+
+
+# Columns of each table that can be exported. Work entries are exported with
+# the columns of importColumns (and their ID), so they can be imported again.
+exportColumns = {
+    'work': ['id', 'date', 'client', 'project', 'project_id', 'hours', 'billable', 'description'],
+    'projects': ['id', 'client', 'name', 'description', 'billable', 'active', 'complete', 'fees'],
+    'contacts': ['id', 'last_name', 'first_name', 'company', 'title', 'phones', 'address', 'comments', 'active'],
+}
+
+
+# Export work entries, projects or contacts as CSV or JSON. Work entries can
+# be limited to dates from and to (inclusive), and to a project; projects
+# and contacts to a project. The rows are read from the cursor in chunks and
+# sent as they are converted, so neither the result nor the output is ever
+# all in memory, however big the table.
+@route('/export/<table:re:[a-z]+>.<fmt:re:csv|json>')
+def export(table, fmt):
+    if table not in exportColumns:
+        raise HTTPError(404, 'No table %s to export' % table)
+
+    # Filters
+    pid = request.query.project
+    if pid:
+        try:
+            pid = int(pid)
+        except ValueError:
+            raise HTTPError(400, 'Project must be an ID')
+    start = request.query.get('from') or '0001-01-01'
+    end = request.query.get('to') or '9999-12-31'
+    if not parseDate(start) or not parseDate(end):
+        raise HTTPError(400, 'Dates must be yyyy-mm-dd')
+
+    # Query for the table and filters
+    if table == 'work':
+        name, params = ('export_project_work', [pid, start, end]) if pid else ('export_work', [start, end])
+    elif table == 'projects':
+        name, params = ('export_project', [pid]) if pid else ('export_projects', [])
+    else:
+        name, params = ('export_project_contacts', [pid]) if pid else ('export_contacts', [])
+
+    # Stream the rows, gzipped if the browser accepts it
+    response.content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/json'
+    response.set_header('Content-Disposition', 'attachment; filename="%s.%s"' % (table, fmt))
+    chunks = exportRows(name, params, exportColumns[table], fmt)
+    response.add_header('Vary', 'Accept-Encoding')
+    if acceptsEncoding('gzip'):
+        response.set_header('Content-Encoding', 'gzip')
+        chunks = gzipChunks(chunks)
+    return chunks
+
+
+# Generate the rows of a named query as CSV with a heading row, or as a JSON
+# list of objects, in chunks of export_chunk_rows rows encoded as UTF-8. The
+# query runs on its own connection rather than one from the pool, as the
+# rows are sent after the request handler has returned, and it may take a
+# while.
+def exportRows(name, params, columns, fmt):
+    db = sql.connect(config['dbname'], check_same_thread = False)
+    try:
+        applyProfile(db)
+        cur = query(db.cursor(), name, *params)
+        s = io.StringIO()
+        if fmt == 'csv':
+            w = csv.writer(s)
+            w.writerow(columns)
+        else:
+            s.write('[')
+        sep = '\n'
+        while True:
+            rows = cur.fetchmany(config['export_chunk_rows'])
+            if not rows:
+                break
+            if fmt == 'csv':
+                w.writerows(rows)
+            else:
+                for r in rows:
+                    s.write(sep)
+                    s.write(json.dumps(dict(zip(columns, r))))
+                    sep = ',\n'
+            yield s.getvalue().encode('utf8')
+            s.seek(0)
+            s.truncate()
+        if fmt == 'json':
+            s.write('\n]\n')
+        yield s.getvalue().encode('utf8')
+    finally:
+        db.close()
+
+
+# Gzip a stream of chunks, one chunk at a time
+def gzipChunks(chunks):
+    z = zlib.compressobj(config['compress_level'], zlib.DEFLATED, 31)   # 31 = gzip format
+    try:
+        for c in chunks:
+            c = z.compress(c)
+            if c:
+                yield c
+        yield z.flush()
+    finally:
+        chunks.close()
+
+
 #--------------------------------------------------------------------#
 #                         SUPPORT FUNCTIONS                          #
 #--------------------------------------------------------------------#
 
 
-# Menu options
-menu = [
-    ['History', ''],
-    ['New log', 'new_log'],
-    ['Calendar', 'calendar'],
-    ['Projects', 'projects'], 
-    ['Contacts', 'contacts'],
-    ['Reports', 'reports']]
+# Menu options (a tuple, as it is shared by all threads)
+menu = (
+    ('History', ''),
+    ('New log', 'new_log'),
+    ('Calendar', 'calendar'),
+    ('Projects', 'projects'),
+    ('Contacts', 'contacts'),
+    ('Reports', 'reports'),
+    ('Search', 'search'),
+    ('Import/Export', 'import'))
+
+
+# Pool of long-lived database connections. A thread borrows one connection
+# the first time it calls getDB() during a request, gets the same one back on
+# later calls, and returns it to the pool when the request is finished. If all
+# connections are in use, the request waits until one is released.
+class ConnectionPool:
+
+    def __init__(self, dbname, size = 8, timeout = 30.0):
+        self.dbname = dbname
+        self.size = size
+        self.timeout = timeout
+        self.idle = []       # open connections not currently borrowed
+        self.nopen = 0       # number of connections opened by the pool
+        self.local = threading.local()
+        self.cond = threading.Condition()
+        self.stats = {'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0,
+                'optimizes': 0}
+        self.lastOptimize = time.time()
+        self.versionDB = None  # connection reading the data version
+        self.versionLock = threading.Lock()
+
+    # Open a new connection, may be used by different threads over its life
+    def connect(self):
+        db = sql.connect(self.dbname, check_same_thread = False, factory = TimedConnection,
+                cached_statements = config['cached_statements'])
+        applyProfile(db)
+        if config['sql_trace']:
+            db.set_trace_callback(traceText)
+            db.set_progress_handler(traceProgress, traceStepSize)
+        return db
+
+    # Get the connection for the current thread, borrowing one if necessary
+    def acquire(self):
+
+        # Same connection for the rest of the request
+        db = getattr(self.local, 'db', None)
+        if db:
+            return db
+
+        # Take an idle connection, or wait for one if they are all in use
+        with self.cond:
+            if not self.idle and self.nopen >= self.size:
+                self.stats['waits'] += 1
+                if not self.cond.wait_for(lambda: self.idle or self.nopen < self.size,
+                        self.timeout):
+                    self.stats['timeouts'] += 1
+                    raise HTTPError(503, 'No database connection available')
+            if self.idle:
+                self.stats['hits'] += 1
+                db = self.idle.pop()
+            else:
+                self.stats['misses'] += 1
+                self.nopen += 1
+
+        # Open a new connection outside the lock
+        if not db:
+            try:
+                db = self.connect()
+            except:
+                with self.cond:
+                    self.nopen -= 1
+                    self.cond.notify()
+                raise
+
+        self.local.db = db
+        return db
+
+    # Give the current thread's connection back to the pool, discarding any
+    # changes that were not committed
+    def release(self):
+        db = getattr(self.local, 'db', None)
+        if not db:
+            return
+        self.local.db = None
+        with self.cond:
+            optimize = time.time() - self.lastOptimize > config['optimize_interval']
+            if optimize:
+                self.lastOptimize = time.time()
+                self.stats['optimizes'] += 1
+        try:
+            if db.in_transaction:
+                db.rollback()
+            if optimize:
+                db.execute('pragma optimize')
+        except sql.Error:
+            db.close()
+            db = None
+        with self.cond:
+            if db:
+                self.idle.append(db)
+            else:
+                self.nopen -= 1
+            self.cond.notify()
+
+    # Close all idle connections, e.g., at shutdown
+    def close(self):
+        with self.cond:
+            for db in self.idle:
+                db.execute('pragma optimize')
+                db.close()
+            self.nopen -= len(self.idle)
+            self.idle = []
+        with self.versionLock:
+            if self.versionDB:
+                self.versionDB.close()
+                self.versionDB = None
+
+    # Pool statistics, as a dictionary
+    def statistics(self):
+        with self.cond:
+            st = dict(self.stats)
+            st.update({'size': self.size, 'open': self.nopen, 'idle': len(self.idle),
+                'in_use': self.nopen - len(self.idle)})
+            st['data_version'] = self.dataVersion()
+            return st
+
+    # Version of the data, which changes whenever the data is written: the
+    # counter that triggers on the data tables increment (see
+    # createDataVersion). All processes see alike, so writes by other
+    # workers or programs (e.g., --import or the sqlite shell) count too, but
+    # saving sessions doesn't.
+    def dataVersion(self):
+        with self.versionLock:
+            if not self.versionDB:
+                self.versionDB = sql.connect(self.dbname, check_same_thread = False)
+            return query(self.versionDB.cursor(), 'data_version').fetchone()[0]
+
+    # Forget the connections of the parent process after a fork, they must
+    # not be used by the child
+    def reset(self):
+        self.idle = []
+        self.nopen = 0
+        self.local = threading.local()
+        self.cond = threading.Condition()
+        self.versionDB = None
+        self.versionLock = threading.Lock()
+
+
+# Time spent in SQL by the current thread's request, and number of queries,
+# reset by the metrics plugin at the start of each request
+sqlTime = threading.local()
+
+
+# Add the time since t to the current request's SQL time
+def addSqlTime(t, queries = 0):
+    try:
+        sqlTime.seconds += time.perf_counter() - t
+        sqlTime.queries += queries
+    except AttributeError:   # not in a request
+        pass
+
+
+# Database cursor that adds the time taken by queries (and fetching their
+# results) to the request's SQL time, and records them if SQL is traced
+class TimedCursor(sql.Cursor):
+
+    entry = None   # trace of the last statement
 
+    def execute(self, *args):
+        t = time.perf_counter()
+        mark = traceMark()
+        try:
+            return sql.Cursor.execute(self, *args)
+        finally:
+            addSqlTime(t, 1)
+            if mark:
+                self.entry = traceStatement(mark, t, self.rowcount)
+
+    def executemany(self, *args):
+        t = time.perf_counter()
+        mark = traceMark()
+        try:
+            return sql.Cursor.executemany(self, *args)
+        finally:
+            addSqlTime(t, 1)
+            if mark:
+                self.entry = traceStatement(mark, t, self.rowcount)
+
+    def fetchone(self):
+        return self.fetch(sql.Cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self.fetch(sql.Cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self.fetch(sql.Cursor.fetchall)
+
+    def fetch(self, method, *args):
+        t = time.perf_counter()
+        mark = traceMark()
+        rows = None
+        try:
+            rows = method(self, *args)
+            return rows
+        finally:
+            addSqlTime(t)
+            if mark and self.entry:
+                n = len(rows) if isinstance(rows, list) else int(rows is not None)
+                traceFetch(self.entry, mark, t, n)
+
+
+# Database connection whose cursors (including those of db.execute()) are
+# timed, as well as commits
+class TimedConnection(sql.Connection):
+
+    def cursor(self, factory = TimedCursor):
+        return sql.Connection.cursor(self, factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        t = time.perf_counter()
+        try:
+            return sql.Connection.commit(self)
+        finally:
+            addSqlTime(t)
 
-# Get database handler, new version using SQLite
+
+# Apply the configured performance settings to a new database connection.
+# The journal mode is kept in the database file, so leave it out (journal =
+# False) to leave the file as it is.
+def applyProfile(db, journal = True):
+    if config['db_profile'] != 'performance':
+        return
+    for k in ['busy_timeout', 'journal_mode', 'synchronous', 'cache_size',
+            'mmap_size', 'temp_store']:
+        if journal or k != 'journal_mode':
+            db.execute('pragma %s = %s' % (k, config[k]))
+
+
+# The connection pool used by all requests, made by create_app()
+pool = None
+
+
+# Get database handler for this request, from the connection pool
 def getDB():
-    return sql.connect(dbname)
+    return pool.acquire()
+
+
+# Bottle plugin to give the request's database connection back to the pool
+# when the request is finished, even if the handler raised an exception
+# (e.g., a redirect)
+def release_db(callback):
+    def wrapper(*args, **kwargs):
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            pool.release()
+    return wrapper
 
 
 # Get next ID for a table
@@ -1506,12 +2611,154 @@ def readFile(fname):
     return data
 
 
+# Cache of page fragments, such as static files and the page header. Each
+# fragment is built once and kept until one of the files it was built from
+# changes on disk, which is checked at most every few seconds.
+class FragmentCache:
+
+    def __init__(self, interval = 2.0):
+        self.interval = interval
+        self.entries = {}   # key => [text, file mtimes, time last checked]
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+    # Get a fragment, calling build() to make it if not cached or if any of
+    # the files have changed since
+    def get(self, key, build, files = ()):
+
+        # Use the cached fragment if recently checked
+        now = time.time()
+        with self.lock:
+            e = self.entries.get(key)
+            if e and now - e[2] < self.interval:
+                self.stats['hits'] += 1
+                return e[0]
+
+        # Otherwise check whether the files have changed
+        mtimes = [os.stat(f).st_mtime_ns for f in files]
+        if e and e[1] == mtimes:
+            with self.lock:
+                e[2] = now
+                self.stats['hits'] += 1
+            return e[0]
+
+        # Build the fragment
+        text = build()
+        with self.lock:
+            self.stats['reloads' if e else 'misses'] += 1
+            self.entries[key] = [text, mtimes, now]
+        return text
+
+    # Contents of a file
+    def file(self, fname):
+        return self.get(fname, lambda: readFile(fname), [fname])
+
+    # Cache statistics, as a dictionary
+    def statistics(self):
+        with self.lock:
+            st = dict(self.stats)
+            st['entries'] = len(self.entries)
+            return st
+
+
+# The fragment cache used by all pages, made by create_app()
+fragments = None
+
+
+# Cache of whole pages, such as reports, that only change when the data does.
+# The cache is emptied when any request has written to the database, and at
+# midnight (as the reports depend on today's date). Least recently used pages
+# are dropped when the pages take more than the given number of bytes; pages
+# returned as dictionaries count as their size in JSON.
+class ResponseCache:
+
+    def __init__(self, maxsize = 8388608):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()   # key => (page, bytes), oldest first
+        self.size = 0                  # bytes used by all pages
+        self.version = None            # (data version, date) of the pages
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    # Get a page, calling build() to make it if not cached
+    def get(self, key, build):
+
+        # Use the cached page if the data has not changed
+        version = (pool.dataVersion(), today())
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.stats['invalidations'] += 1
+                self.entries.clear()
+                self.size = 0
+                self.version = version
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+            self.stats['misses'] += 1
+
+        # Build the page, and keep it unless the data changed meanwhile
+        page = build()
+        n = self.pageSize(page)
+        with self.lock:
+            if version == self.version and key not in self.entries and n <= self.maxsize:
+                self.entries[key] = (page, n)
+                self.size += n
+                while self.size > self.maxsize:
+                    k, (old, oldSize) = self.entries.popitem(last = False)
+                    self.size -= oldSize
+                    self.stats['evictions'] += 1
+        return page
+
+    # Bytes taken by a page, i.e., by its JSON if it is a dictionary
+    def pageSize(self, page):
+        return len(json.dumps(page)) if isinstance(page, dict) else len(page)
+
+    # Cache statistics, as a dictionary
+    def statistics(self):
+        with self.lock:
+            st = dict(self.stats)
+            st.update({'entries': len(self.entries), 'bytes': self.size,
+                'maxsize': self.maxsize})
+            return st
+
+
+# The page cache used by reports, made by create_app()
+responses = None
+
+
+# Bottle plugin to keep the pages of routes marked with cache=True, which
+# depend only on the URL and the data, in the page cache
+class CachePlugin:
+
+    name = 'cache'
+    api = 2
+
+    def apply(self, callback, route):
+        if not route.config.get('cache'):
+            return callback
+        def wrapper(*args, **kwargs):
+            key = (request.path, request.query_string)
+            return responses.get(key, lambda: callback(*args, **kwargs))
+        return wrapper
+
+
 # Start page
 def header(s, current = None):  # TODO: highlight current selection
+    s.write(fragments.get(('header', current), lambda: headerHTML(current),
+        ['static/header.html', 'static/style.css']))
+
 
-    # Static page header
+# Build the start of a page: static header, and menu
+def headerHTML(current):
+
+    # Static page header, with links to static files including their hash
     #s.write('Content-Type: text/html\n\n')
-    s.write(readFile('static/header.html'))
+    s = io.StringIO()
+    s.write(re.sub(r'"/static/([^"?]+)"', lambda m: '"%s"' % assetUrl(m.group(1)),
+        readFile('static/header.html')))
 
     # Anchor to go to top of page
     s.write('<a name="top"></a>')
@@ -1526,6 +2773,7 @@ def header(s, current = None):  # TODO: highlight current selection
             href += '#bottom'
         s.write('<a href="/%s">%s</a>\n' % (href, label))
     s.write('</div>\n')
+    return s.getvalue()
 
 
 # Finish page
@@ -1533,6 +2781,15 @@ def footer(s):
     s.write('</body>\n</html>\n')
 
 
+# Render table rows with a row template, which is a dictionary with a
+# variant of the HTML for each kind of row (e.g., billable or not) as a %
+# format string. Each row is given as (variant, values), and they are all
+# formatted and joined at once, rather than writing each cell to the page
+# separately.
+def renderRows(template, rows):
+    return ''.join([template[k] % a for k, a in rows])
+
+
 # Print a table row
 def tr(s, cells):
     s.write('<tr style="vertical-align: top">\n')
@@ -1558,6 +2815,7 @@ def parseDate(s):
 
 # Format date as "Mon 23/04/2015" 
 dnames = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+mnames = ['', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 
 # Format a date as "Tue 21/02/2016"
 def formatDate(dt):
@@ -1573,14 +2831,296 @@ def fmtDate(dt):
     return datetime.strftime(dt, '%Y-%m-%d')
 
 
+# First day of a month and of the following month, as "yyyy-mm-dd", for
+# selecting a month with work_date >= start and work_date < end
+def monthRange(y, m):
+    ny, nm = (y + 1, 1) if m == 12 else (y, m + 1)
+    return '%d-%02d-01' % (y, m), '%d-%02d-01' % (ny, nm)
+
+
 # Today's date
 def today():
     return datetime.now().date()
 
-# Clean a string prior to inserting into SQL statement, i.e., remove leading
-# trailing blanks and apostrophes
+
+# First day of the time log, which only includes the last 6 months (180
+# days): the first day of the month 180 days ago
+def logStart():
+    t0 = today() - timedelta(180)
+    return '%d-%02d-01' % (t0.year, t0.month)
+
+# Clean a string from a form, i.e., remove leading and trailing blanks (values
+# are passed to SQL as parameters, so apostrophes need no escaping)
 def clean(s):
-    return s.strip().replace("'", "\\'")
+    return s.strip()
+
+
+#--------------------------------------------------------------------#
+#                          ROLLUP TABLES                             #
+#--------------------------------------------------------------------#
+
+
+# Rollup tables with hours and number of entries for each period, project
+# and billable flag, so reports don't need to add up individual work
+# entries. The period is the date of the day, the Monday of the week, or the
+# first of the month, computed from a work row like this:
+rollups = {
+    'work_daily': 'date(%s.work_date)',
+    'work_weekly': "date(%s.work_date, 'weekday 0', '-6 days')",
+    'work_monthly': "date(%s.work_date, 'start of month')"}
+
+
+# Create the rollup tables and the triggers that keep them in sync with the
+# work table, and fill them with existing data. Entries with bad dates are
+# left out.
+def createRollups(cur):
+
+    for table, period in rollups.items():
+
+        cur.execute('create table if not exists %s (period date not null, project_id integer not null, '
+            'billable boolean not null, hours double not null, entries integer not null, '
+            'primary key (period, project_id, billable)) without rowid' % table)
+
+        # Add the new row of an insert/update to its rollup
+        add = 'insert into %s values (%s, new.project_id, coalesce(new.billable, 0) <> 0, coalesce(new.hours, 0), 1)' % (table, period % 'new')
+        add += ' on conflict (period, project_id, billable) do update set hours = hours + excluded.hours, entries = entries + 1;'
+
+        # Subtract the old row of an update/delete from its rollup, and remove
+        # the rollup when no entries are left
+        key = 'period = %s and project_id = old.project_id and billable = (coalesce(old.billable, 0) <> 0)' % (period % 'old')
+        sub = 'update %s set hours = hours - coalesce(old.hours, 0), entries = entries - 1 where %s;' % (table, key)
+        sub += ' delete from %s where %s and entries <= 0;' % (table, key)
+
+        newOk = 'when %s is not null' % (period % 'new')
+        oldOk = 'when %s is not null' % (period % 'old')
+        cols = 'project_id, work_date, hours, billable'
+        cur.execute('create trigger if not exists %s_insert after insert on work %s begin %s end' % (table, newOk, add))
+        cur.execute('create trigger if not exists %s_delete after delete on work %s begin %s end' % (table, oldOk, sub))
+        cur.execute('create trigger if not exists %s_update_old after update of %s on work %s begin %s end' % (table, cols, oldOk, sub))
+        cur.execute('create trigger if not exists %s_update_new after update of %s on work %s begin %s end' % (table, cols, newOk, add))
+
+    rebuildRollups(cur)
+
+
+# Recompute the rollup tables from the work table
+def rebuildRollups(cur):
+    for table, period in rollups.items():
+        cur.execute('delete from %s' % table)
+        q = 'insert into %s select %s, project_id, coalesce(billable, 0) <> 0, sum(coalesce(hours, 0)), count(*)' % (table, period % 'work')
+        q += ' from work where %s is not null group by 1, 2, 3' % (period % 'work')
+        cur.execute(q)
+
+
+#--------------------------------------------------------------------#
+#                           SEARCH INDEX                             #
+#--------------------------------------------------------------------#
+
+
+# Full-text search index of work entries, projects and contacts, one FTS5
+# table for all of them. For each kind of record: its number, and SQL for the
+# date, title and text of its index row, from a row of its table (%(r)s).
+# The rowid of an index row is the record's ID times 3 plus the number, so
+# the triggers find it directly. The tag column holds a word found nowhere
+# else, "kind" and the number, so each kind can be searched on its own (the
+# kind's name would also match every work entry titled with a project).
+# Work entries are titled with their project, so a search for a client finds
+# the work done for it.
+searchSources = OrderedDict([
+    ('work', (0, '%(r)s.work_date',
+        "(select coalesce(client, '') || ' ' || coalesce(name, '') from project where id = %(r)s.project_id)",
+        "coalesce(%(r)s.description, '')",
+        'id, project_id, work_date, description')),
+    ('project', (1, 'null',
+        "coalesce(%(r)s.client, '') || ' ' || coalesce(%(r)s.name, '')",
+        "coalesce(%(r)s.description, '')",
+        'id, client, name, description')),
+    ('contact', (2, 'null',
+        "coalesce(%(r)s.first_name, '') || ' ' || coalesce(%(r)s.last_name, '')",
+        "coalesce(%(r)s.company, '') || ' ' || coalesce(%(r)s.title, '') || ' ' || coalesce(%(r)s.comments, '')",
+        'id, first_name, last_name, company, title, comments'))])
+
+
+# Create the search index and the triggers that keep it in sync with the
+# tables, and fill it with the existing records
+def createSearch(cur):
+
+    cur.execute('create virtual table if not exists search using fts5(kind unindexed, ref unindexed, '
+        "date unindexed, title, body, tag, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')")
+
+    for table, (k, date, title, body, cols) in searchSources.items():
+        add = 'insert into search (rowid, kind, ref, date, title, body, tag) values '
+        add += "(new.id * 3 + %d, '%s', new.id, %s, %s, %s, 'kind%d');" % (k, table, date % {'r': 'new'},
+            title % {'r': 'new'}, body % {'r': 'new'}, k)
+        sub = 'delete from search where rowid = old.id * 3 + %d;' % k
+        cur.execute('create trigger if not exists search_%s_insert after insert on %s begin %s end' % (table, table, add))
+        cur.execute('create trigger if not exists search_%s_delete after delete on %s begin %s end' % (table, table, sub))
+        cur.execute('create trigger if not exists search_%s_update after update of %s on %s begin %s %s end'
+            % (table, cols, table, sub, add))
+
+    # Work entries are titled with their project, so change them with it
+    cur.execute('create trigger if not exists search_project_work after update of client, name on project '
+        'when old.client is not new.client or old.name is not new.name begin '
+        "update search set title = coalesce(new.client, '') || ' ' || coalesce(new.name, '') "
+        'where rowid in (select id * 3 from work where project_id = new.id); end')
+
+    rebuildSearch(cur)
+
+
+# Make the search index again, e.g., after changing its columns
+def recreateSearch(cur):
+    cur.execute('drop table if exists search')
+    createSearch(cur)
+
+
+# Recompute the search index from the tables
+def rebuildSearch(cur):
+    cur.execute('delete from search')
+    for table, (k, date, title, body, cols) in searchSources.items():
+        cur.execute('insert into search (rowid, kind, ref, date, title, body, tag) '
+            "select id * 3 + %d, '%s', id, %s, %s, %s, 'kind%d' from %s" % (k, table, date % {'r': table},
+            title % {'r': table}, body % {'r': table}, k, table))
+    cur.execute("insert into search (search) values ('optimize')")
+
+
+#--------------------------------------------------------------------#
+#                          DATA VERSION                              #
+#--------------------------------------------------------------------#
+
+
+# Tables whose changes are counted in the data version, i.e., those the
+# pages show (sessions are left out)
+versionedTables = ['work', 'project', 'contact', 'project_contact']
+
+
+# Create the data_version table, a single counter that triggers increment
+# whenever a versioned table is written, by any connection or program. The
+# page cache and ETags depend on it.
+def createDataVersion(cur):
+    cur.execute('create table if not exists data_version (id integer primary key check (id = 0), '
+        'version integer not null)')
+    cur.execute('insert or ignore into data_version values (0, 0)')
+    for table in versionedTables:
+        for op in ['insert', 'update', 'delete']:
+            cur.execute('create trigger if not exists %s_%s_version after %s on %s '
+                'begin update data_version set version = version + 1; end' % (table, op, op, table))
+
+
+#--------------------------------------------------------------------#
+#                        SCHEMA MIGRATIONS                           #
+#--------------------------------------------------------------------#
+
+
+# Changes to the database schema, in the order they are applied. The
+# database's user_version is the number of steps it already has. Each step
+# is the name of an SQL file, a list of SQL statements, or a function that is
+# passed a cursor. Never change a step once released, add a new one instead.
+migrations = [
+
+    ('Create tables', 'create_database.sql'),
+
+    # Date filters must be written as ranges on work_date (not
+    # substr(work_date,...)) to use these
+    ('Index work by date', [
+        'create index if not exists work_date_project on work(work_date, project_id)',
+        'create index if not exists work_date_covering on work(work_date, project_id, hours, billable)']),
+
+    ('Daily, weekly and monthly rollups of work', createRollups),
+
+    ('Sessions', [
+        'create table if not exists session (sid text primary key, data text not null, expires real not null) without rowid',
+        'create index if not exists session_expires on session(expires)']),
+
+    ('Full-text search of work, projects and contacts', createSearch),
+
+    # Contacts are found by the start of these, ignoring case
+    ('Index contact names', [
+        'create index if not exists contact_last_name on contact(last_name collate nocase, id)',
+        'create index if not exists contact_first_name on contact(first_name collate nocase)',
+        'create index if not exists contact_company on contact(company collate nocase)']),
+
+    ('Count changes to the data', createDataVersion),
+
+    ('Search each kind of record on its own', recreateSearch),
+
+    # The contact list pages through this, so contacts without a last name
+    # are listed too
+    ('Index contacts in list order', [
+        "create index if not exists contact_list on contact(coalesce(last_name, '') collate nocase, id)"]),
+]
+
+
+# Split SQL text into statements
+def sqlStatements(text):
+    stmts = []
+    q = ''
+    for r in text.splitlines(True):
+        q += r
+        if sql.complete_statement(q):
+            stmts.append(q.strip())
+            q = ''
+    return stmts
+
+
+# Apply the migrations the database doesn't have yet, each in its own
+# transaction, and return a list of (step, title, seconds). For a dry run,
+# the pending steps are run and timed, then rolled back.
+def migrate(fname, dry_run = False, verbose = True):
+
+    # New database, a dry run tests the migrations on an empty one in memory
+    if not os.path.exists(fname):
+        if verbose:
+            print('Database %s not found, %s' % (fname, 'testing with empty database' if dry_run else 'creating it'))
+        if dry_run:
+            fname = ':memory:'
+    db = sql.connect(fname, isolation_level = None)   # explicit transactions
+    applyProfile(db, journal = not dry_run)   # a dry run changes nothing
+    cur = db.cursor()
+    applied = []
+
+    if dry_run:
+        cur.execute('begin immediate')
+    try:
+        for n in range(1, len(migrations) + 1):
+
+            # Check version inside the transaction, in case another process
+            # is migrating the same database
+            if not dry_run:
+                cur.execute('begin immediate')
+            cur.execute('pragma user_version')
+            if cur.fetchone()[0] >= n:
+                if not dry_run:
+                    cur.execute('commit')
+                continue
+
+            # Apply this step
+            title, step = migrations[n - 1]
+            t = time.time()
+            if callable(step):
+                step(cur)
+            else:
+                if isinstance(step, str):
+                    step = sqlStatements(readFile(step))
+                for q in step:
+                    cur.execute(q)
+            cur.execute('pragma user_version = %d' % n)
+            if not dry_run:
+                cur.execute('commit')
+            t = time.time() - t
+
+            applied.append((n, title, t))
+            if verbose:
+                print('%s migration %d: %s (%.3f sec)' % ('Tested' if dry_run else 'Applied', n, title, t))
+
+    except:
+        if db.in_transaction:
+            cur.execute('rollback')
+        raise
+    finally:
+        if dry_run and db.in_transaction:
+            cur.execute('rollback')
+        db.close()
+
+    return applied
 
 
 #--------------------------------------------------------------------#
@@ -1588,8 +3128,8 @@ def clean(s):
 #--------------------------------------------------------------------#
 
 
-# Simple session handling. Session ID is stored in a cookie, and
-# the session data is stored in a JSON file with that name in /tmp
+# Session data is a dictionary, stored as JSON under a session ID that is
+# kept in a cookie. The session store chosen in the settings holds the data.
 def get_session():
 
     # Get the current session ID from cookie, create if not there
@@ -1598,21 +3138,227 @@ def get_session():
         sid = uuid.uuid4().hex
         response.set_cookie('sid', sid)
 
-    # Get the session file and return as a dictionary; if no session
-    # file yet, just return an empty dictionary
-    sfile = session_dir + '/' + sid
-    if os.path.exists(sfile):
-        return json.loads(readFile(sfile))
+    # Get the session data as a dictionary; if no session yet, just return
+    # an empty dictionary
+    data = sessions.load(sid)
+    if data:
+        return json.loads(data)
     else:
         return { 'sid' : sid }
 
 
 # Save the session, creates a new session ID if current one is not found
 def save_session(sdata):
-    sid = sdata['sid']
-    f = open(session_dir + '/' + sid, 'w')
-    f.write(json.dumps(sdata))
-    f.close()
+    sessions.save(sdata['sid'], json.dumps(sdata, sort_keys = True))
+
+
+# Sessions kept in memory, least recently used first, and written to the
+# session table in the background a few seconds after they change. Sessions
+# not used for session_ttl seconds are removed from memory and the table.
+# If other processes share the table, sessions are always read from the
+# table, and written to it at once.
+class SessionStore:
+
+    def __init__(self, dbname, size = 1000, ttl = 2592000, interval = 5.0):
+        self.dbname = dbname
+        self.size = size
+        self.ttl = ttl
+        self.interval = interval
+        self.entries = OrderedDict()  # sid => [data, expires, expires saved]
+        self.dirty = set()            # sids changed since last flush
+        self.lock = threading.Lock()
+        self.dblock = threading.Lock()
+        self.db = None
+        self.writer = None
+        self.shared = False
+        self.stats = {'hits': 0, 'misses': 0, 'loads': 0, 'writes': 0,
+                'unchanged': 0, 'expired': 0, 'evictions': 0}
+
+    # Forget the sessions and connection of the parent process after a fork
+    def reset(self):
+        self.entries = OrderedDict()
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.dblock = threading.Lock()
+        self.db = None
+        self.writer = None
+
+    # Connection used only for sessions, so saving a session doesn't count
+    # as a change to the data (e.g., for the page cache)
+    def connect(self):
+        if not self.db:
+            self.db = sql.connect(self.dbname, check_same_thread = False)
+            applyProfile(self.db)
+        return self.db
+
+    # Get the data for a session as JSON, None if not found or expired
+    def load(self, sid):
+        now = time.time()
+        with self.lock:
+            e = self.entries.get(sid)
+            if e and e[1] > now and not self.shared:
+                self.entries.move_to_end(sid)
+                e[1] = now + self.ttl
+                self.stats['hits'] += 1
+                return e[0]
+            self.stats['misses'] += 1
+
+        # Not in memory, look in the table
+        with self.dblock:
+            r = self.connect().execute('select data, expires from session where sid = ? and expires > ?',
+                    (sid, now)).fetchone()
+        if not r:
+            return None
+        with self.lock:
+            self.stats['loads'] += 1
+            if sid not in self.dirty:
+                self.entries[sid] = [r[0], now + self.ttl, r[1]]
+                self.evict()
+        return r[0]
+
+    # Save the data for a session, if it changed. Sessions that are in use
+    # are also written now and then to keep them from expiring.
+    def save(self, sid, data):
+        now = time.time()
+        with self.lock:
+            e = self.entries.get(sid)
+            if e and e[0] == data and (sid in self.dirty or e[2] > now + self.ttl / 2):
+                self.stats['unchanged'] += 1
+                return
+            if e:
+                e[0] = data
+                e[1] = now + self.ttl
+                self.entries.move_to_end(sid)
+            else:
+                self.entries[sid] = [data, now + self.ttl, 0]
+                self.evict()
+            self.dirty.add(sid)
+            if not self.writer and not self.shared:
+                self.writer = threading.Thread(target = self.writeBehind, daemon = True)
+                self.writer.start()
+        if self.shared:
+            self.flush()
+
+    # Drop least recently used sessions if too many, keeping changed ones
+    # until they have been written (called with the lock held)
+    def evict(self):
+        for sid in list(self.entries):
+            if len(self.entries) <= self.size:
+                break
+            if sid not in self.dirty:
+                del self.entries[sid]
+                self.stats['evictions'] += 1
+
+    # Background thread: write changed sessions, delete expired ones
+    def writeBehind(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except sql.Error as e:
+                print('Could not save sessions:', e)
+
+    # Write changed sessions to the table, and remove expired sessions
+    def flush(self):
+        now = time.time()
+        with self.lock:
+            rows = [(sid, self.entries[sid][0], self.entries[sid][1])
+                    for sid in self.dirty if sid in self.entries]
+            self.dirty = set()
+            for sid in [sid for sid, e in self.entries.items() if e[1] <= now]:
+                del self.entries[sid]
+                self.stats['expired'] += 1
+
+        # Write them; if that fails (e.g., the database is locked), they are
+        # still changed, and written by the next flush
+        try:
+            with self.dblock:
+                db = self.connect()
+                with db:
+                    db.executemany('insert into session (sid, data, expires) values (?, ?, ?)'
+                        ' on conflict (sid) do update set data = excluded.data, expires = excluded.expires',
+                        rows)
+                    db.execute('delete from session where expires <= ?', (now,))
+        except:
+            with self.lock:
+                self.dirty.update(sid for sid, data, expires in rows if sid in self.entries)
+            raise
+        with self.lock:
+            for sid, data, expires in rows:
+                if sid in self.entries:
+                    self.entries[sid][2] = expires
+            self.stats['writes'] += len(rows)
+
+    # Store statistics, as a dictionary
+    def statistics(self):
+        with self.lock:
+            st = dict(self.stats)
+            st.update({'store': 'db', 'entries': len(self.entries), 'dirty': len(self.dirty)})
+            return st
+
+
+# Sessions kept in JSON files, one per session, in a directory. Files not
+# changed for ttl seconds are removed when the store is flushed.
+class FileSessionStore:
+
+    def __init__(self, dirname, ttl = 2592000):
+        self.dirname = dirname
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.stats = {'loads': 0, 'writes': 0, 'expired': 0}
+        if not os.path.exists(dirname):
+            print('Creating session directory:', dirname)
+            os.mkdir(dirname)
+
+    # Get the data for a session as JSON, None if not found
+    def load(self, sid):
+        sfile = os.path.join(self.dirname, os.path.basename(sid))
+        if not os.path.exists(sfile):
+            return None
+        with self.lock:
+            self.stats['loads'] += 1
+        return readFile(sfile)
+
+    # Save the data for a session
+    def save(self, sid, data):
+        f = open(os.path.join(self.dirname, os.path.basename(sid)), 'w')
+        f.write(data)
+        f.close()
+        with self.lock:
+            self.stats['writes'] += 1
+
+    # Nothing to forget after a fork
+    def reset(self):
+        self.lock = threading.Lock()
+
+    # Remove expired session files
+    def flush(self):
+        now = time.time()
+        for fname in os.listdir(self.dirname):
+            sfile = os.path.join(self.dirname, fname)
+            if os.stat(sfile).st_mtime + self.ttl < now:
+                os.remove(sfile)
+                with self.lock:
+                    self.stats['expired'] += 1
+
+    # Store statistics, as a dictionary
+    def statistics(self):
+        with self.lock:
+            st = dict(self.stats)
+            st['store'] = 'file'
+            return st
+
+
+# The session store used by all requests, made by create_app()
+sessions = None
+
+
+# In a worker process started by the pre-fork server, which shares the
+# database with the other workers
+def afterFork():
+    pool.reset()
+    sessions.reset()
+    sessions.shared = True
 
 
 # Save the session ID in the next cookie (NOT USED)
@@ -1626,19 +3372,950 @@ def remember_session():
 def isTrue(v):
     return str(v).lower() in ['1', '1.0', 'true', 'yes']
 
+#--------------------------------------------------------------------#
+#                            SQL TRACING                             #
+#--------------------------------------------------------------------#
+
+
+# If sql_trace is set, the statements run by each request are recorded: the
+# SQLite trace callback gives the text of each statement (with parameters
+# filled in), the progress handler counts virtual machine steps, and the
+# timed cursors add the time and number of rows. At the end of the request,
+# slow statements are logged with their query plan, and statements of the
+# same shape run many times (e.g., one query per row of another) are flagged.
+
+# Statements of the current thread's request, while it is traced
+sqlTrace = threading.local()
+
+# Number of SQLite virtual machine steps between calls to traceProgress()
+traceStepSize = 1000
+
+
+# SQLite trace callback: remember the text of a statement that is starting
+def traceText(text):
+    texts = getattr(sqlTrace, 'texts', None)
+    if texts is not None:
+        texts.append(text)
+
+
+# SQLite progress handler: count steps
+def traceProgress():
+    if getattr(sqlTrace, 'texts', None) is not None:
+        sqlTrace.steps += 1
+
+
+# Where the trace is before a statement, or None if not tracing
+def traceMark():
+    texts = getattr(sqlTrace, 'texts', None)
+    if texts is None:
+        return None
+    return (len(texts), sqlTrace.steps)
+
+
+# Record a statement run since the mark, return its entry (None if it was
+# not traced)
+def traceStatement(mark, t, rowcount):
+    n, steps = mark
+    texts = [x for x in sqlTrace.texts[n:] if x.strip().upper() not in ['BEGIN', 'COMMIT', 'ROLLBACK']]
+    del sqlTrace.texts[n:]
+    if not texts:   # e.g., PRAGMAs before the trace callback was set
+        return None
+    e = {'sql': texts[0] if texts else '', 'seconds': time.perf_counter() - t,
+            'rows': max(rowcount, 0), 'steps': (sqlTrace.steps - steps) * traceStepSize,
+            'statements': len(texts)}   # more than one for executemany() or triggers
+    sqlTrace.entries.append(e)
+    return e
+
+
+# Add fetching rows to a statement's entry
+def traceFetch(e, mark, t, nrows):
+    e['seconds'] += time.perf_counter() - t
+    e['steps'] += (sqlTrace.steps - mark[1]) * traceStepSize
+    e['rows'] += nrows
+
+
+# Shape of a statement: the SQL with literal values replaced by ?
+def statementShape(text):
+    text = re.sub(r"'(?:[^']|'')*'", '?', text)
+    text = re.sub(r'(?<![\w.])-?\d+(\.\d+)?\b', '?', text)
+    text = re.sub(r'\(\s*\?(\s*,\s*\?)*\s*\)', '(?)', text)
+    return ' '.join(text.split())
+
+
+# Bottle plugin to trace the SQL statements of each request, keeping the
+# most recent requests, slow statements and repeated statements for the
+# debug page
+class SqlTracePlugin:
+
+    name = 'sqltrace'
+    api = 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []   # most recent first
+        self.slow = []
+        self.repeated = []
+        self.db = None       # for EXPLAIN QUERY PLAN, not traced
+
+    def apply(self, callback, route):
+        def wrapper(*args, **kwargs):
+            sqlTrace.texts = []
+            sqlTrace.entries = []
+            sqlTrace.steps = 0
+            t = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                entries = sqlTrace.entries
+                del sqlTrace.texts, sqlTrace.entries, sqlTrace.steps
+                url = request.path + ('?' + request.query_string if request.query_string else '')
+                self.finish(url, time.perf_counter() - t, entries)
+        return wrapper
+
+    # Check the statements of a finished request
+    def finish(self, url, seconds, entries):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        slow = []
+        for e in entries:
+            if e['seconds'] * 1000.0 >= config['slow_query_ms']:
+                plan = self.explain(e['sql'])
+                print('Slow query on %s: %.1f ms, %d rows\n  %s\n  %s' % (url, e['seconds'] * 1000.0,
+                    e['rows'], e['sql'], '\n  '.join(plan)), file = sys.stderr)
+                slow.append({'time': now, 'url': url, 'entry': e, 'plan': plan})
+
+        shapes = {}
+        for e in entries:
+            k = statementShape(e['sql'])
+            shapes[k] = shapes.get(k, 0) + 1
+        repeated = []
+        for k, n in shapes.items():
+            if n >= config['repeated_queries']:
+                print('Statement run %d times on %s (N+1 queries?): %s' % (n, url, k), file = sys.stderr)
+                repeated.append({'time': now, 'url': url, 'count': n, 'shape': k})
+
+        keep = config['trace_requests']
+        with self.lock:
+            self.requests.insert(0, {'time': now, 'url': url, 'seconds': seconds, 'entries': entries,
+                'slow': len(slow), 'repeated': len(repeated)})
+            self.slow[:0] = slow
+            self.repeated[:0] = repeated
+            del self.requests[keep:], self.slow[keep:], self.repeated[keep:]
+
+    # Query plan of a statement, as lines of text
+    def explain(self, text):
+        if text.split(None, 1)[0].lower() not in ['select', 'with', 'insert', 'update', 'delete', 'replace']:
+            return []
+        try:
+            with self.lock:
+                if not self.db:
+                    self.db = sql.connect(config['dbname'], check_same_thread = False)
+                rows = self.db.execute('explain query plan ' + text).fetchall()
+            return [r[3] for r in rows]
+        except sql.Error as e:
+            return ['(%s)' % e]
+
+    # Copies of the recent requests, slow and repeated statements
+    def recent(self):
+        with self.lock:
+            return list(self.requests), list(self.slow), list(self.repeated)
+
+
+sqlTracer = SqlTracePlugin()
+
+
+# Debug page: recent requests with their SQL, slow statements with their
+# query plans, and repeated statements; ?req=n shows the statements of the
+# n-th most recent request. It shows the SQL of everyone's requests, so
+# create_app() only adds the route when sql_trace is on.
+def debug_sql():
+    requests, slow, repeated = sqlTracer.recent()
+    s = io.StringIO()
+    header(s)
+    s.write('<div style="padding: 32px">\n')
+    s.write('<h1>SQL Trace</h1>\n')
+
+    # Statements of one request (a bad or unknown number is ignored)
+    try:
+        req = int(request.query.req) if request.query.req else -1
+    except ValueError:
+        req = -1
+    if 0 <= req < len(requests):
+        r = requests[req]
+        s.write('<h2>%s</h2>\n' % htmlText(r['url']))
+        s.write('<table border="1">\n')
+        tr(s, ['<b>ms</b>', '<b>Rows</b>', '<b>Steps</b>', '<b>SQL</b>'])
+        for e in r['entries']:
+            tr(s, ['%.2f' % (e['seconds'] * 1000.0), e['rows'], e['steps'],
+                '<code>%s</code>' % htmlText(e['sql'])])
+        s.write('</table>\n')
+
+    # Recent requests
+    s.write('<h2>Recent requests</h2>\n')
+    s.write('<table border="1">\n')
+    tr(s, ['<b>Time</b>', '<b>URL</b>', '<b>ms</b>', '<b>SQL ms</b>', '<b>Statements</b>',
+        '<b>Slow</b>', '<b>Repeated</b>'])
+    for i, r in enumerate(requests):
+        tr(s, [r['time'], '<a href="/debug/sql?req=%d">%s</a>' % (i, htmlText(r['url'])),
+            '%.1f' % (r['seconds'] * 1000.0), '%.1f' % (sum(e['seconds'] for e in r['entries']) * 1000.0),
+            len(r['entries']), r['slow'] or '', r['repeated'] or ''])
+    s.write('</table>\n')
+
+    # Slow statements
+    s.write('<h2>Slow statements (over %g ms)</h2>\n' % config['slow_query_ms'])
+    s.write('<table border="1">\n')
+    tr(s, ['<b>Time</b>', '<b>URL</b>', '<b>ms</b>', '<b>Rows</b>', '<b>SQL and query plan</b>'])
+    for x in slow:
+        e = x['entry']
+        tr(s, [x['time'], htmlText(x['url']), '%.1f' % (e['seconds'] * 1000.0), e['rows'],
+            '<code>%s</code><pre>%s</pre>' % (htmlText(e['sql']), htmlText('\n'.join(x['plan'])))])
+    s.write('</table>\n')
+
+    # Repeated statements
+    s.write('<h2>Statements run %d or more times in a request</h2>\n' % config['repeated_queries'])
+    s.write('<table border="1">\n')
+    tr(s, ['<b>Time</b>', '<b>URL</b>', '<b>Times</b>', '<b>Statement</b>'])
+    for x in repeated:
+        tr(s, [x['time'], htmlText(x['url']), x['count'], '<code>%s</code>' % htmlText(x['shape'])])
+    s.write('</table>\n')
+
+    s.write('</div>\n')
+    footer(s)
+    return s.getvalue()
+
+
+# Escape text for HTML
+def htmlText(s):
+    return str(s).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+# Escape text for an HTML attribute value in double quotes
+def htmlAttr(s):
+    return htmlText(s).replace('"', '&quot;')
+
+
+#--------------------------------------------------------------------#
+#                          THREADED SERVER                           #
+#--------------------------------------------------------------------#
+
+
+# WSGI server that hands each connection to a fixed pool of worker threads,
+# through a queue of limited length. When the queue is full, connections
+# are refused with "503 Service Unavailable" rather than left waiting.
+# Closing the server lets the workers finish the queued connections first.
+class PoolWSGIServer(WSGIServer):
+
+    def __init__(self, address, handler, threads = 8, queue_size = 64, sock = None):
+        self.requests = queue.Queue(queue_size)
+        self.workers = []
+        if sock:
+            # Listen on a socket opened by the parent process
+            WSGIServer.__init__(self, address, handler, bind_and_activate = False)
+            self.socket.close()
+            self.socket = sock
+            host, port = sock.getsockname()[:2]
+            self.server_name = socket.getfqdn(host)
+            self.server_port = port
+            self.setup_environ()
+        else:
+            WSGIServer.__init__(self, address, handler)
+        for i in range(threads):
+            t = threading.Thread(target = self.work, name = 'worker-%d' % i, daemon = True)
+            t.start()
+            self.workers.append(t)
+
+    # Queue a new connection for the workers
+    def process_request(self, request, client_address):
+        try:
+            self.requests.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\n'
+                    b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    # Worker thread: handle connections until told to stop (None)
+    def work(self):
+        while True:
+            r = self.requests.get()
+            if r is None:
+                return
+            request, client_address = r
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    # Stop accepting connections, and wait for the workers to finish
+    def server_close(self):
+        WSGIServer.server_close(self)
+        for t in self.workers:
+            self.requests.put(None)
+        deadline = time.time() + config['shutdown_timeout']
+        for t in self.workers:
+            t.join(max(0.0, deadline - time.time()))
+
+
+# Request handler that keeps HTTP/1.1 connections open for more requests,
+# as long as the response has a length and the request had no body (which
+# the application might not have read). An idle connection holds a worker
+# thread, so it is closed as soon as other connections are waiting for one
+# (browsers open a new connection when a kept-alive one has been closed).
+class KeepAliveHandler(WSGIRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    quiet = False
+    idleCheck = 0.05   # seconds between checks for waiting connections
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_request()
+        while not self.close_connection and self.nextRequest():
+            self.handle_request()
+
+    # Wait for the next request on the connection: True when it can be
+    # read, False if none came within the timeout or another connection is
+    # waiting for a thread
+    def nextRequest(self):
+
+        # A request already read into the buffer (pipelined)
+        self.connection.settimeout(0)
+        try:
+            if self.rfile.peek(1):
+                return True
+        except OSError:
+            pass
+        finally:
+            self.connection.settimeout(self.timeout)
+
+        # Wait a little at a time, giving up the thread if needed
+        deadline = time.time() + (self.timeout or 0.0)
+        while True:
+            if not self.server.requests.empty():
+                return False
+            wait = min(self.idleCheck, deadline - time.time())
+            if wait <= 0:
+                return False
+            if select.select([self.connection], [], [], wait)[0]:
+                return True
+
+    def handle_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (socket.timeout, ConnectionError):
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = True
+            return
+        if not self.parse_request():  # an error has been sent
+            return
+        if self.command not in ['GET', 'HEAD']:
+            self.close_connection = True
+
+        handler = KeepAliveServerHandler(self.rfile, self.wfile, self.get_stderr(),
+                self.get_environ(), multithread = True)
+        handler.http_version = self.request_version[5:]
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        if not handler.keepalive:
+            self.close_connection = True
+
+    # No reverse DNS lookups
+    def address_string(self):
+        return self.client_address[0]
+
+    def log_request(self, *args, **kwargs):
+        if not self.quiet:
+            WSGIRequestHandler.log_request(self, *args, **kwargs)
+
+
+# WSGI handler that notes whether the response allows the connection to be
+# kept open, before the headers are discarded
+class KeepAliveServerHandler(ServerHandler):
+
+    keepalive = False
+
+    def close(self):
+        h = self.headers
+        self.keepalive = h is not None and 'Content-Length' in h \
+                and h.get('Connection', '').lower() != 'close'
+        ServerHandler.close(self)
+
+
+# Bottle adapter for the threaded server, e.g., run(server = ThreadedServer).
+# SIGTERM (as well as Ctrl-C) shuts the server down gracefully.
+class ThreadedServer(ServerAdapter):
+
+    def run(self, app):
+
+        class Handler(KeepAliveHandler):
+            quiet = self.quiet
+            timeout = config['keepalive_timeout']
+
+        self.srv = PoolWSGIServer((self.host, self.port), Handler,
+                self.options.get('threads', config['threads']),
+                self.options.get('queue_size', config['queue_size']),
+                self.options.get('sock'))
+        self.srv.set_app(app)
+        self.port = self.srv.server_port
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, stopServer)
+        try:
+            self.srv.serve_forever()
+        finally:
+            self.srv.server_close()
+
+
+# Signal handler to stop the server, like Ctrl-C
+def stopServer(signum, frame):
+    raise KeyboardInterrupt
+
+
+# Bottle adapter for the pre-fork server, e.g., run(server = PreforkServer,
+# workers = 4). The parent process opens the listening socket, then starts
+# worker processes that each accept connections on it and handle them with
+# the threaded server. Workers that die are started again. Ctrl-C or SIGTERM
+# stops the workers gracefully.
+class PreforkServer(ServerAdapter):
+
+    def run(self, app):
+        sock = socket.create_server((self.host, self.port), backlog = 128)
+        self.port = sock.getsockname()[1]
+        nworkers = self.options.get('workers', config['workers']) or os.cpu_count()
+        self.children = {}   # pid => time started
+        self.stopping = False
+        signal.signal(signal.SIGTERM, stopServer)
+        try:
+            while True:
+
+                # Start workers, slowly if they keep dying
+                while len(self.children) < nworkers:
+                    self.children[self.fork(app, sock)] = time.time()
+                pid, status = os.wait()
+                started = self.children.pop(pid, None)
+                if started is not None:
+                    print('Worker %d exited (status %d), restarting' % (pid,
+                        os.waitstatus_to_exitcode(status)))
+                    if time.time() - started < 1.0:
+                        time.sleep(1.0)
+        except KeyboardInterrupt:
+            self.stopping = True
+            for pid in self.children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for pid in self.children:
+                try:
+                    os.waitpid(pid, 0)
+                except (OSError, KeyboardInterrupt):
+                    pass
+            raise
+        finally:
+            sock.close()
+
+    # Start a worker process, return its process ID
+    def fork(self, app, sock):
+        pid = os.fork()
+        if pid:
+            return pid
+        status = 0
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            srv = ThreadedServer(self.host, self.port, sock = sock,
+                    threads = self.options.get('threads', config['threads']))
+            srv.quiet = self.quiet
+            srv.run(app)
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sessions.flush()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+
 #--------------------------------------------------------------------#
 #                            START SERVER                            #
 #-------------------------------------------------------------------#
 
 
-# Serve static files
-@route('/static/<filename:path>')
+# Request metrics, in the Prometheus text format
+@route('/metrics', etag = False)
+def metrics_page():
+    response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return metrics.exposition()
+
+
+# Show internal statistics, as JSON
+@route('/stats', etag = False)
+def stats():
+    return {'pool': pool.statistics(), 'fragments': fragments.statistics(),
+        'responses': responses.statistics(), 'compression': compression.statistics(),
+        'etags': etags.statistics(), 'sessions': sessions.statistics()}
+
+
+# Serve static files. Files in the static directory are kept in memory,
+# with gzip (and brotli if available) compressed copies, and sent with
+# ETags. The URLs from assetUrl() include a hash of the file, and can be
+# cached by browsers for good.
+@route('/static/<filename:path>', etag = False)
 def serve_static(filename):
-    return static_file(filename, root = os.getcwd() + '/static')
+
+    # Files that are not there, or outside the static directory
+    a = getAsset(filename)
+    if not a:
+        return static_file(filename, root = os.getcwd() + '/static')
+
+    # Best encoding the browser accepts, and the ETag for it
+    enc = None
+    for e in ['br', 'gzip']:
+        if e in a['data'] and acceptsEncoding(e):
+            enc = e
+            break
+    headers = {'ETag': '"%s%s"' % (a['hash'], '-' + enc if enc else ''),
+            'Vary': 'Accept-Encoding'}
+    if request.query.v == a['hash']:
+        headers['Cache-Control'] = 'public, max-age=%d, immutable' % config['asset_max_age']
+    else:
+        headers['Cache-Control'] = 'no-cache'
+    if headers['ETag'] in request.headers.get('If-None-Match', ''):
+        return HTTPResponse(status = 304, **headers)
+
+    headers['Content-Type'] = a['type']
+    if enc:
+        headers['Content-Encoding'] = enc
+    return HTTPResponse(a['data'][enc], **headers)
+
+
+# URL of a static file, including the hash of its contents
+def assetUrl(fname):
+    a = getAsset(fname)
+    return '/static/%s?v=%s' % (fname, a['hash']) if a else '/static/' + fname
+
+
+# A static file with its hash and compressed versions, from the fragment
+# cache so that it is loaded again if it changes, or None if not found
+def getAsset(fname):
+    root = os.path.abspath('static')
+    path = os.path.abspath(os.path.join(root, fname))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    return fragments.get(('asset', path), lambda: loadAsset(path), [path])
+
+
+# Read a static file, compressing text files
+def loadAsset(path):
+    data = open(path, 'rb').read()
+    mtype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    a = {'hash': hashlib.sha1(data).hexdigest()[:16], 'data': {None: data},
+            'type': mtype + ('; charset=UTF-8' if mtype.startswith('text/') else '')}
+    if mtype.startswith('text/') or mtype in ['application/javascript', 'image/svg+xml']:
+        z = gzip.compress(data, 9, mtime = 0)
+        if len(z) < len(data):
+            a['data']['gzip'] = z
+        if brotli:
+            a['data']['br'] = brotli.compress(data)
+    return a
+
+
+# Load all static files, e.g., at startup
+def loadAssets():
+    for d, dirs, files in os.walk('static'):
+        for f in files:
+            getAsset(os.path.relpath(os.path.join(d, f), 'static'))
+
+
+# Determine whether the browser accepts an encoding, e.g., gzip
+def acceptsEncoding(enc):
+    for e in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, q = e.partition(';')
+        if name.strip() == enc:
+            q = q.strip()
+            try:
+                return not q.startswith('q=') or float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+# Bottle plugin to gzip pages (and JSON) for browsers that accept it, if they
+# are large enough, and keep statistics on compression for each route.
+# Responses that are already compressed (e.g., static files) are sent as is.
+class CompressionPlugin:
+
+    name = 'compress'
+    api = 2
+
+    def __init__(self):
+        self.stats = {}   # route => counts
+        self.lock = threading.Lock()
+
+    def apply(self, callback, route):
+        rule = route.rule
+
+        def wrapper(*args, **kwargs):
+            body = callback(*args, **kwargs)
+            if isinstance(body, dict):
+                response.content_type = 'application/json'
+                body = json.dumps(body)
+            if isinstance(body, str):
+                body = body.encode(response.charset or 'utf8')
+            if not isinstance(body, bytes) or 'Content-Encoding' in response \
+                    or len(body) < config['compress_min_size']:
+                return body
+
+            # Compress if accepted, and remember how well it went
+            response.add_header('Vary', 'Accept-Encoding')
+            if not acceptsEncoding('gzip'):
+                self.count(rule, len(body), len(body), 0.0, False)
+                return body
+            t = time.perf_counter()
+            z = gzip.compress(body, config['compress_level'], mtime = 0)
+            self.count(rule, len(body), len(z), time.perf_counter() - t, True)
+            response.set_header('Content-Encoding', 'gzip')
+            return z
+
+        return wrapper
+
+    # Add a response to the statistics for a route
+    def count(self, rule, size, zsize, seconds, compressed):
+        with self.lock:
+            st = self.stats.setdefault(rule, {'responses': 0, 'compressed': 0,
+                'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0})
+            st['responses'] += 1
+            if compressed:
+                st['compressed'] += 1
+                st['bytes_in'] += size
+                st['bytes_out'] += zsize
+                st['seconds'] += seconds
+
+    # Statistics for each route, with compression ratio and average time
+    def statistics(self):
+        with self.lock:
+            st = {}
+            for rule, c in self.stats.items():
+                st[rule] = dict(c)
+                st[rule]['ratio'] = c['bytes_out'] / c['bytes_in'] if c['bytes_in'] else 1.0
+                st[rule]['ms_per_response'] = c['seconds'] * 1000.0 / c['compressed'] if c['compressed'] else 0.0
+            return st
+
+
+compression = CompressionPlugin()
+
+
+# Bottle plugin to answer repeated GET requests for pages that have not
+# changed with "304 Not Modified", before the page is built. The ETag depends
+# on the data version, the date, the URL and the program itself, so any
+# change to the data makes all pages new again. Routes whose pages depend on
+# something else (e.g., the session), or that change the data, are marked
+# with etag=False.
+class ETagPlugin:
+
+    name = 'etag'
+    api = 2
+
+    def __init__(self):
+        self.seed = str(os.stat(__file__).st_mtime_ns)
+        self.stats = {'checked': 0, 'not_modified': 0}
+        self.lock = threading.Lock()
+
+    def apply(self, callback, route):
+        if route.method != 'GET' or not route.config.get('etag', True):
+            return callback
+
+        def wrapper(*args, **kwargs):
+            tag = self.etag()
+            match = tag in request.headers.get('If-None-Match', '')
+            with self.lock:
+                self.stats['checked'] += 1
+                if match:
+                    self.stats['not_modified'] += 1
+            if match:
+                raise HTTPResponse(status = 304, headers = {'ETag': tag,
+                    'Cache-Control': 'no-cache'})
+            body = callback(*args, **kwargs)
+            response.set_header('ETag', tag)
+            response.set_header('Cache-Control', 'no-cache')
+            return body
+
+        return wrapper
+
+    # Weak ETag for the current request, the same with or without gzip
+    def etag(self):
+        key = '%s|%s|%s|%s|%s' % (self.seed, pool.dataVersion(), today(),
+                request.path, request.query_string)
+        return 'W/"%s"' % hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+
+    # Statistics, as a dictionary
+    def statistics(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+etags = ETagPlugin()
+pageCache = CachePlugin()
+
+
+# Bottle plugin to collect, for each route, histograms of the time taken by
+# requests, the size of responses and the time spent in SQL, and counts by
+# status code, shown by /metrics. Each request only costs a few additions
+# under a lock, so it can be left on. With the pre-fork server, each worker
+# process has its own metrics.
+class MetricsPlugin:
+
+    name = 'metrics'
+    api = 2
+
+    # Upper bounds of the histogram buckets, seconds and bytes
+    timeBuckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    sizeBuckets = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.histograms = {}   # (metric, route, method) => [bucket counts, sum]
+        self.statuses = {}     # (route, method, status) => count
+        self.queries = {}      # (route, method) => number of SQL statements
+
+    def apply(self, callback, route):
+        key = (route.rule, route.method)
+
+        def wrapper(*args, **kwargs):
+            with self.lock:
+                self.inflight += 1
+            sqlTime.seconds = 0.0
+            sqlTime.queries = 0
+            t = time.perf_counter()
+            body = None
+            status = 500
+            try:
+                body = callback(*args, **kwargs)
+                status = body.status_code if isinstance(body, HTTPResponse) else response.status_code
+                return body
+            except HTTPResponse as e:   # e.g., redirects and errors
+                body = e
+                status = e.status_code
+                raise
+            finally:
+                self.record(key, status, time.perf_counter() - t, self.size(body),
+                        sqlTime.seconds, sqlTime.queries)
+                del sqlTime.seconds, sqlTime.queries
+
+        return wrapper
+
+    # Size of a response body, if known
+    def size(self, body):
+        if isinstance(body, HTTPResponse):
+            body = body.body
+        return len(body) if isinstance(body, (str, bytes)) else 0
+
+    # Add a request to the metrics
+    def record(self, key, status, seconds, size, sqlSeconds, queries):
+        with self.lock:
+            self.inflight -= 1
+            k = key + (status,)
+            self.statuses[k] = self.statuses.get(k, 0) + 1
+            self.queries[key] = self.queries.get(key, 0) + queries
+            self.observe(('request_duration_seconds',) + key, self.timeBuckets, seconds)
+            self.observe(('response_size_bytes',) + key, self.sizeBuckets, size)
+            self.observe(('sql_duration_seconds',) + key, self.timeBuckets, sqlSeconds)
+
+    # Add a value to a histogram (called with the lock held)
+    def observe(self, hkey, buckets, value):
+        h = self.histograms.get(hkey)
+        if not h:
+            h = self.histograms[hkey] = [[0] * (len(buckets) + 1), 0.0]
+        h[0][bisect.bisect_left(buckets, value)] += 1
+        h[1] += value
+
+    # All metrics, in the Prometheus text exposition format
+    def exposition(self):
+        with self.lock:
+            histograms = dict((k, [list(h[0]), h[1]]) for k, h in self.histograms.items())
+            statuses = dict(self.statuses)
+            queries = dict(self.queries)
+            inflight = self.inflight
+        out = []
+        for metric, help, buckets in [
+                ('request_duration_seconds', 'Time taken to handle requests', self.timeBuckets),
+                ('response_size_bytes', 'Size of response bodies', self.sizeBuckets),
+                ('sql_duration_seconds', 'Time spent in SQL per request', self.timeBuckets)]:
+            out.append('# HELP timelog_%s %s' % (metric, help))
+            out.append('# TYPE timelog_%s histogram' % metric)
+            for (m, rule, method), (counts, total) in sorted(histograms.items()):
+                if m != metric:
+                    continue
+                labels = 'route="%s",method="%s"' % (promLabel(rule), method)
+                n = 0
+                for le, c in zip(buckets + ['+Inf'], counts):
+                    n += c
+                    out.append('timelog_%s_bucket{%s,le="%s"} %d' % (metric, labels, le, n))
+                out.append('timelog_%s_sum{%s} %s' % (metric, labels, repr(total)))
+                out.append('timelog_%s_count{%s} %d' % (metric, labels, n))
+        out.append('# HELP timelog_requests_total Requests handled, by status code')
+        out.append('# TYPE timelog_requests_total counter')
+        for (rule, method, status), n in sorted(statuses.items()):
+            out.append('timelog_requests_total{route="%s",method="%s",status="%d"} %d'
+                    % (promLabel(rule), method, status, n))
+        out.append('# HELP timelog_sql_queries_total SQL statements executed')
+        out.append('# TYPE timelog_sql_queries_total counter')
+        for (rule, method), n in sorted(queries.items()):
+            out.append('timelog_sql_queries_total{route="%s",method="%s"} %d' % (promLabel(rule), method, n))
+        out.append('# HELP timelog_requests_in_flight Requests being handled')
+        out.append('# TYPE timelog_requests_in_flight gauge')
+        out.append('timelog_requests_in_flight %d' % inflight)
+
+        # Connection pool and page cache
+        ps = pool.statistics()
+        rs = responses.statistics()
+        for name, kind, help, value in [
+                ('db_connections_open', 'gauge', 'Open database connections', ps['open']),
+                ('db_connections_in_use', 'gauge', 'Database connections borrowed by requests', ps['in_use']),
+                ('db_connection_waits_total', 'counter', 'Requests that waited for a connection', ps['waits']),
+                ('page_cache_hits_total', 'counter', 'Pages served from the page cache', rs['hits']),
+                ('page_cache_misses_total', 'counter', 'Pages built for the page cache', rs['misses'])]:
+            out.append('# HELP timelog_%s %s' % (name, help))
+            out.append('# TYPE timelog_%s %s' % (name, kind))
+            out.append('timelog_%s %d' % (name, value))
+        return '\n'.join(out) + '\n'
+
+
+# Escape a Prometheus label value
+def promLabel(s):
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = MetricsPlugin()
+
+
+# Make the application: read the settings (with any given ones taking
+# precedence), and set up the connection pool, caches, session store and
+# plugins. Nothing is opened until the first request, and the database is
+# not touched, so this is quick; run migrate() before serving requests.
+def create_app(settings = None):
+    global pool, fragments, responses, sessions
+
+    loadConfig()
+    if settings:
+        config.update(settings)
+
+    # Shared by all requests (and copied to pre-fork workers)
+    if pool:
+        pool.close()
+    pool = ConnectionPool(config['dbname'], config['pool_size'])
+    fragments = FragmentCache(config['fragment_check_interval'])
+    responses = ResponseCache(config['response_cache_size'])
+    if config['session_store'] == 'file':
+        sessions = FileSessionStore(config['session_dir'], config['session_ttl'])
+    else:
+        sessions = SessionStore(config['dbname'], config['session_cache_size'],
+                config['session_ttl'], config['session_flush_interval'])
+
+    # Plugins, outermost first: metrics (so they include everything else),
+    # SQL tracing, give back the database connection, check ETags, compress, and last the
+    # page cache (so that cached pages are compressed for each request)
+    app = default_app()
+    plugins = [release_db, etags, compression, pageCache]
+    if config['sql_trace']:
+        plugins.insert(0, sqlTracer)
+        if not any(r.rule == '/debug/sql' for r in app.routes):
+            app.route('/debug/sql', callback = debug_sql, etag = False)
+    if config['metrics']:
+        plugins.insert(0, metrics)
+    for p in plugins:
+        if p not in app.plugins:
+            app.install(p)
+
+    # Reset the connection pool and session store in worker processes
+    if not app.config.get('timelog.fork_hook') and hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child = afterFork)
+        app.config['timelog.fork_hook'] = True
+    return app
 
 
 # Start server, debug options on workstations
-wks = socket.gethostname() in ['shuttle', 'brix', 'MUNMAC-45759-1']
-#print("Host name:", socket.gethostname(), wks)
-run(host = 'localhost', port = 9999, reloader = wks, debug = wks, quiet = not wks)
+def main():
+
+    app = create_app()
+    ap = argparse.ArgumentParser(description = 'Time log web application')
+    ap.add_argument('--dry-run', action = 'store_true',
+            help = 'test pending database migrations without applying them, then exit')
+    ap.add_argument('--rebuild-rollups', action = 'store_true',
+            help = 'recompute the daily/weekly/monthly rollup tables and the search index, then exit')
+    ap.add_argument('--import', dest = 'import_file', metavar = 'FILE',
+            help = 'import work entries from a CSV or JSON file, then exit')
+    ap.add_argument('--server', choices = ['threaded', 'prefork', 'wsgiref'], default = config['server'],
+            help = 'web server: threaded (default), prefork (processes with threads), or single threaded wsgiref')
+    ap.add_argument('--threads', type = int, default = config['threads'],
+            help = 'number of worker threads (per process) for the threaded and prefork servers')
+    ap.add_argument('--workers', type = int, default = config['workers'],
+            help = 'number of worker processes for the prefork server, 0 = one per CPU')
+    ap.add_argument('--port', type = int, default = config['port'],
+            help = 'port to listen on')
+    args = ap.parse_args()
+
+    # Bring database schema up to date
+    if args.dry_run:
+        if not migrate(config['dbname'], dry_run = True):
+            print('Database %s is up to date' % config['dbname'])
+        sys.exit()
+    migrate(config['dbname'])
+    loadAssets()
+    sessions.flush()   # remove expired sessions
+
+    # Backfill rollup tables and search index, e.g., after changing the work
+    # table by hand
+    if args.rebuild_rollups:
+        db = sql.connect(config['dbname'])
+        t = time.time()
+        rebuildRollups(db.cursor())
+        rebuildSearch(db.cursor())
+        query(db.cursor(), 'bump_data_version')
+        db.commit()
+        print('Rebuilt rollup tables and search index in %.3f sec' % (time.time() - t))
+        sys.exit()
+
+    # Import work entries from a file
+    if args.import_file:
+        fmt = 'json' if args.import_file.lower().endswith('.json') else 'csv'
+        with open(args.import_file, encoding = 'utf-8-sig', newline = '') as f:
+            report = importWork(sql.connect(config['dbname']), readImport(f, fmt))
+        for n, reason in report['rejects']:
+            print('Row %d: %s' % (n, reason))
+        print('Imported %d of %d rows in %.3f sec (%.0f rows/sec), %d rejected' % (report['imported'],
+            report['rows'], report['seconds'], report['rows_per_sec'], report['rejected']))
+        sys.exit(1 if report['rejected'] else 0)
+
+    print('Started in %.0f ms' % ((time.perf_counter() - started) * 1000.0))
+    wks = socket.gethostname() in ['shuttle', 'brix', 'MUNMAC-45759-1']
+    #print("Host name:", socket.gethostname(), wks)
+    if args.server == 'prefork':
+        run(app, server = PreforkServer, workers = args.workers, threads = args.threads,
+                host = config['host'], port = args.port, reloader = wks, debug = wks, quiet = not wks)
+    elif args.server == 'threaded':
+        run(app, server = ThreadedServer, threads = args.threads, host = config['host'], port = args.port,
+                reloader = wks, debug = wks, quiet = not wks)
+    else:
+        run(app, host = config['host'], port = args.port, reloader = wks, debug = wks, quiet = not wks)
+
+    # Save changed sessions before exiting
+    sessions.flush()
+
 
+if __name__ == '__main__':
+    main()